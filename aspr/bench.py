@@ -0,0 +1,271 @@
+"""Benchmarks of the simulator's hot paths"""
+
+from aspr.sim.scenario import Scenario
+from aspr.sim.state import History
+from aspr.sim.decision_model import DecisionModelFactory
+from aspr.sim.interference_model import BinaryInterference
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.utils import _setup_logger
+from aspr.model.features import FeatureExtractor
+from aspr.model.linreg import LinearRegressorLearner
+from aspr.constants import OUTPUTS, SPT_FN, MODELS
+from sklearn.linear_model import LinearRegression
+from datetime import datetime
+import pandas as pd
+import numpy as np
+import os, json, time, random, platform, tempfile, tracemalloc, click
+from os.path import join, exists, dirname
+
+@click.command()
+@click.option('-n', '--n-nodes', type=int, multiple=True, default=[20, 100], help='Numbers of nodes to benchmark.')
+@click.option('-c', '--n-colors', type=int, multiple=True, default=[3, 5], help='Numbers of colors to benchmark.')
+@click.option('-t', '--time-window', type=int, multiple=True, default=[50, 500], help='Spawn time windows to benchmark.')
+@click.option('-dm', '--decision-model', multiple=True, default=['random', 'greedy', 'linreg'], type=click.Choice(DecisionModelFactory.options()), help='Decision models to benchmark.')
+@click.option('-r', '--n-runs', default=5, help='Number of scenario runs per benchmark.')
+@click.option('-o', '--output', default=join(OUTPUTS, 'bench', 'results.json'), help='File to save results to.')
+@click.option('-b', '--baseline', default=None, help='Results file to compare against.')
+@click.option('-th', '--threshold', default=0.2, help='Slowdown against the baseline to report as a regression, eg. 0.2 for 20%.')
+@click.option('-v', '--verbose', count=True, help='Log level. Options: -v -vv')
+def cli(n_nodes, n_colors, time_window, decision_model, n_runs, output,
+  baseline, threshold, verbose):
+  """Times Scenario.run, State.score, History.record, decision models'
+  decide() and FeatureExtractor.extract over a grid of scenarios"""
+  bench = Benchmark(n_runs, verbose)
+  results = bench.run_grid(n_nodes, n_colors, time_window, decision_model)
+  for r in results:
+    click.echo(format_result(r))
+  bench.save(results, output)
+  click.echo(f'Saved results to {output}')
+
+  if baseline:
+    regressions = compare(results, Benchmark.load(baseline)['results'], threshold)
+    for r, ratio in regressions:
+      click.echo(f'REGRESSION {ratio:.2f}x: {format_result(r)}')
+    if regressions:
+      raise click.exceptions.Exit(1)
+    click.echo(f'No regressions against {baseline}')
+  return 0
+
+
+# the fields which identify a benchmark, for comparison against a baseline
+KEY = ['bench', 'n_nodes', 'n_colors', 'time_window', 'decision_model']
+
+DM_ARGS = {'greedy': 'ps=5'}
+
+
+class Benchmark:
+  """Times the simulator's hot paths over a grid of scenarios.
+
+  For each combination of node count, color count and time window, a set of
+  spawn times is generated and n_runs scenarios are run with a random
+  decision model. The states and logs of these runs are used to time
+  History.record, State.score and FeatureExtractor.extract, and their
+  features are used to fit the regressors for the linreg decision model.
+  Then for each decision model, Scenario.run and decide() are timed.
+
+  Each result has the time per call and calls per second, and the peak
+  memory allocated while making the calls as measured by tracemalloc. Scenario
+  results also have ticks and runs per second.
+
+  Parameters
+  ----------
+
+  n_runs (int) : Number of scenario runs per benchmark
+
+  verbose (int) : Log verbosity. Options: {0: lowest, 1: info, 2: debug}
+  """
+  def __init__(self, n_runs=5, verbose=0):
+    self.n_runs = n_runs
+    self.verbose = verbose
+    self.name = 'Benchmark'
+    self.logger = _setup_logger(self, verbose = verbose)
+
+
+  def run_grid(self, n_nodes, n_colors, time_windows, dm_names):
+    results = []
+    for n in n_nodes:
+      for k in n_colors:
+        for t_win in time_windows:
+          if t_win <= n:
+            self.logger.warning(f'Skipping n={n}, t={t_win}: spawn times must be unique')
+            continue
+          results.extend(self.run_case(n, k, t_win, dm_names))
+    return results
+
+
+  def run_case(self, n, k, t_win, dm_names):
+    """All benchmarks for one scenario size"""
+    self.logger.info(f'Benchmarking n={n}, c={k}, t={t_win}')
+    case = dict(n_nodes=n, n_colors=k, time_window=t_win)
+    spt = [int(s) for s in SpawnTimeUtil().random_unique(n, t_win)]
+    colors = list(range(k))
+
+    with tempfile.TemporaryDirectory() as tmp:
+      SpawnTimeUtil().save(spt, tmp)
+      scenarios = [self.scenario(spt, colors, 'random', None, seed)
+        for seed in range(self.n_runs)]
+      for s in scenarios: s.run()
+      states = [state for s in scenarios for state in s.history.read()]
+      dfs = [s.to_df() for s in scenarios]
+
+      results = [
+        self.bench_record(states, case),
+        self.bench_score(states, case),
+        self.bench_extract(FeatureExtractor(join(tmp, SPT_FN)), dfs, case)]
+
+      model_f = self.fit_linreg(FeatureExtractor(join(tmp, SPT_FN)), dfs,
+        colors, tmp)
+      for dm_name in dm_names:
+        dm_args = model_f if dm_name == 'linreg' else DM_ARGS.get(dm_name)
+        results.append(self.bench_run(spt, colors, dm_name, dm_args, case))
+        results.append(self.bench_decide(spt, colors, dm_name, dm_args,
+          scenarios, case))
+    return results
+
+
+  def scenario(self, spt, colors, dm_name, dm_args, seed, dm=None):
+    random.seed(seed)
+    np.random.seed(seed)
+    if dm is None:
+      dm = self.decision_model(spt, colors, dm_name, dm_args)
+    dm.reset()
+    return Scenario(len(spt), list(spt), colors, dm, BinaryInterference(),
+      f'bench-{dm_name}-{seed}')
+
+
+  def decision_model(self, spt, colors, dm_name, dm_args):
+    return DecisionModelFactory().get(dm_name, colors, dm_args, 0, spt = spt)
+
+
+  def measure(self, fn, calls, **fields):
+    """Times fn(), which makes `calls` calls of the benchmarked code, then
+    runs it again under tracemalloc for the peak memory allocated"""
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+      fn()
+      _, peak = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+
+    result = dict(fields, calls = calls, seconds = seconds,
+      per_call = seconds / max(calls, 1), per_sec = calls / seconds if seconds else None,
+      peak_kb = peak / 1024)
+    self.logger.debug(format_result(result))
+    return result
+
+
+  def bench_run(self, spt, colors, dm_name, dm_args, case):
+    """Scenario.run, reported per run and per tick"""
+    dm = self.decision_model(spt, colors, dm_name, dm_args)
+    ticks = []
+    def run():
+      ticks.clear()
+      for seed in range(self.n_runs):
+        scenario = self.scenario(spt, colors, dm_name, dm_args, seed, dm)
+        scenario.run()
+        ticks.append(len(scenario.history))
+    result = self.measure(run, self.n_runs, bench = 'scenario_run',
+      decision_model = dm_name, **case)
+    result['runs_per_sec'] = result['per_sec']
+    result['ticks_per_sec'] = sum(ticks) / result['seconds']
+    return result
+
+
+  def bench_decide(self, spt, colors, dm_name, dm_args, scenarios, case):
+    """decide() at each spawn of the given runs"""
+    dm = self.decision_model(spt, colors, dm_name, dm_args)
+    # decision models only look at the last row of the history, which is
+    # the tick before the spawn
+    histories = []
+    for scenario in scenarios:
+      states = scenario.history.read()
+      histories.extend([History(prev) for prev, state in zip(states, states[1:])
+        if state.t in spt and state.actvn_cnt > prev.actvn_cnt])
+    def decide():
+      dm.reset()
+      for history in histories: dm.decide(history)
+    return self.measure(decide, len(histories), bench = 'decide',
+      decision_model = dm_name, **case)
+
+
+  def bench_record(self, states, case):
+    """History.record of every state of the given runs"""
+    def record():
+      history = History(states[0])
+      for state in states: history.record(state)
+    return self.measure(record, len(states), bench = 'history_record',
+      decision_model = None, **case)
+
+
+  def bench_score(self, states, case):
+    def score():
+      for state in states: state.score()
+    return self.measure(score, len(states), bench = 'state_score',
+      decision_model = None, **case)
+
+
+  def bench_extract(self, fe, dfs, case):
+    def extract():
+      for df in dfs: fe.extract(df)
+    return self.measure(extract, len(dfs), bench = 'features_extract',
+      decision_model = None, **case)
+
+
+  def fit_linreg(self, fe, dfs, colors, folder):
+    """Fits a regressor for each color to the features of the given runs,
+    saving them where LinearRegressor loads them from. Returns the model
+    folder to pass to LinearRegressor."""
+    features = LinearRegressorLearner(colors).features
+    df = pd.concat([fe.extract(df) for df in dfs], ignore_index = True)
+    df = df[[col for col in features if col in df.columns]]
+    regrs = {}
+    for c in colors:
+      c_df = df.loc[df['decision'] == c, :]
+      if c_df.empty: c_df = df
+      regrs[c] = LinearRegression().fit(c_df.drop(columns = 'loss'), c_df['loss'])
+    LinearRegressorLearner(colors).save_all(regrs,
+      join(folder, f'nc{len(colors)}', MODELS, 'linreg'))
+    return folder
+
+
+  def save(self, results, path):
+    if dirname(path) and not exists(dirname(path)): os.makedirs(dirname(path))
+    out = {
+      'created': datetime.now().isoformat(timespec = 'seconds'),
+      'python': platform.python_version(),
+      'n_runs': self.n_runs,
+      'results': results}
+    with open(path, 'w') as f: json.dump(out, f, indent = 1)
+    return path
+
+
+  @staticmethod
+  def load(path):
+    with open(path, 'r') as f: return json.load(f)
+
+
+def compare(results, baseline, threshold):
+  """Results which take more than (1 + threshold) times as long per call as
+  the same benchmark in baseline. Returns a list of (result, ratio)."""
+  base = {tuple(r.get(k) for k in KEY): r for r in baseline}
+  regressions = []
+  for r in results:
+    b = base.get(tuple(r.get(k) for k in KEY))
+    if b is None or not b['per_call']: continue
+    ratio = r['per_call'] / b['per_call']
+    if ratio > 1 + threshold: regressions.append((r, ratio))
+  return regressions
+
+
+def format_result(r):
+  desc = f'{r["bench"]:<17} n={r["n_nodes"]:<4} c={r["n_colors"]:<3} ' \
+    f't={r["time_window"]:<5}'
+  if r['decision_model']: desc += f' dm={r["decision_model"]}'
+  desc += f': {1e6 * r["per_call"]:.1f}us/call, peak {r["peak_kb"]:.1f}KB'
+  if 'ticks_per_sec' in r:
+    desc += f', {r["runs_per_sec"]:.1f} runs/s, {r["ticks_per_sec"]:.0f} ticks/s'
+  return desc
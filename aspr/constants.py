@@ -3,6 +3,12 @@ OUTPUTS = 'outputs'
 DATA    = 'data'
 MODELS  = 'models'
 SPT_FN  = 'spt.txt'
+MANIFEST_FN = 'manifest.json'
+OPTIMAL_FN = 'optimal.json'
+PROFILE_FN = 'profile.json'
+FEAT_CACHE_DIR = 'features-cache'
+LINREG_STATS_FN = 'stats.npz'
+LINREG_MODEL_FN = 'linreg.mdl'
 MDL_EXT = '.joblib'
 
 NODE_TTL = 10
\ No newline at end of file
@@ -1,21 +1,26 @@
 """ CLI for training models"""
 
-import os, click
+import os, json, click
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from aspr.model.linreg import LinearRegressorLearner
 from aspr.model.features import FeatureExtractor
-from aspr.constants import SPT_FN
-from os.path import join, exists
+from aspr.sim.output import RunStore, file_signature
+from aspr.constants import SPT_FN, MANIFEST_FN
+from os.path import join, exists, basename
 
 @click.command()
 @click.option('-m', '--model-name', required=True, help='Model to train')
 @click.option('-f', '--folder', required=True, help='Folder to use for training')
 @click.option('-c', '--n-colors', type=int, required=True, help='Number of colors in scenario')
+@click.option('-j', '--jobs', type=int, default=1, help='Number of workers for feature extraction and model fitting')
+@click.option('-ca', '--cache', is_flag=True, help='Cache the combined features as binary files, to memory-map on later runs')
+@click.option('-st', '--stream', is_flag=True, help='Train from the features chunk by chunk, adding to the statistics of previous runs')
 @click.option('-v', '--verbose', count=True, help='Log level. Options: -v -vv')
-def cli(model_name, folder, n_colors, verbose):
+def cli(model_name, folder, n_colors, jobs, cache, stream, verbose):
   colors = range(n_colors)
-  feat_f = make_features(folder, colors, verbose)
+  feat_f = make_features(folder, colors, verbose, jobs)
   model = get_model(model_name, colors, verbose)
-  model.train(feat_f)
+  model.train(feat_f, jobs=jobs, cache=cache, stream=stream)
 
 
 def get_model(model_name, colors, verbose):
@@ -23,16 +28,75 @@ def get_model(model_name, colors, verbose):
     return LinearRegressorLearner(colors, verbose)
 
 
-def make_features(folder, colors, verbose):
-  spt_f = join(folder, '..', '..', '..')
-  fe = FeatureExtractor(join(spt_f, SPT_FN), verbose)
+def make_features(folder, colors, verbose, jobs=1):
+  """Extract features from each run file in folder into `<folder>-feat`.
+
+  A manifest of the (mtime, size) of each input is kept in the feature
+  folder, so only new or changed run files are extracted again, and the
+  features of removed run files are deleted.
+  """
+  spt_path = join(folder, '..', '..', '..', SPT_FN)
   dest_folder = f'{folder}-feat'
-  if exists(dest_folder):
-    return dest_folder
-    
-  os.makedirs(dest_folder)
-  for csv_file in [f for f in os.listdir(folder) if '.csv' in f]: 
-    feat_df = fe.extract(os.path.join(folder, csv_file))
-    save_as = os.path.join(dest_folder, csv_file)
-    feat_df.to_csv(save_as, index=False)
-  return dest_folder
\ No newline at end of file
+  if not exists(dest_folder): os.makedirs(dest_folder)
+
+  if RunStore.exists(folder):
+    inputs = RunStore(folder).chunks()
+  else:
+    inputs = [join(folder, f) for f in os.listdir(folder) if '.csv' in f]
+
+  manifest_path = join(dest_folder, MANIFEST_FN)
+  manifest = read_manifest(manifest_path)
+  signatures = {basename(path): file_signature(path) for path in inputs}
+
+  for name in [name for name in manifest if name not in signatures]:
+    out = join(dest_folder, manifest.pop(name)['output'])
+    if exists(out): os.remove(out)
+
+  todo = [path for path in inputs 
+    if manifest.get(basename(path), {}).get('signature') != signatures[basename(path)]]
+  click.echo(f'Extracting features from {len(todo)} of {len(inputs)} files')
+
+  try:
+    if jobs > 1:
+      with ProcessPoolExecutor(max_workers = jobs, initializer = _init_worker,
+        initargs = (spt_path, verbose)) as pool:
+        futures = [pool.submit(_extract, path, dest_folder) for path in todo]
+        for i, future in enumerate(as_completed(futures)):
+          path, out = future.result()
+          manifest[basename(path)] = {
+            'signature': signatures[basename(path)], 'output': out}
+          click.echo(f'Extracted {i + 1}/{len(todo)}: {basename(path)}')
+    else:
+      _init_worker(spt_path, verbose)
+      for path in todo:
+        path, out = _extract(path, dest_folder)
+        manifest[basename(path)] = {
+          'signature': signatures[basename(path)], 'output': out}
+  finally:
+    with open(manifest_path, 'w') as f: json.dump(manifest, f, indent=1)
+
+  return dest_folder
+
+
+def read_manifest(path):
+  if not exists(path): return {}
+  with open(path, 'r') as f: return json.load(f)
+
+
+_worker_fe = None
+
+def _init_worker(spt_path, verbose):
+  """Builds the FeatureExtractor used by a worker process"""
+  global _worker_fe
+  _worker_fe = FeatureExtractor(spt_path, verbose)
+
+
+def _extract(path, dest_folder):
+  """Extract features from one run file. Returns the input path and the name
+  of the file written"""
+  if path.endswith(RunStore.EXT):
+    out = _worker_fe.extract_chunk(path, dest_folder)
+  else:
+    out = join(dest_folder, basename(path))
+    _worker_fe.extract(path).to_csv(out, index=False)
+  return path, basename(out)
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import os, glob, click
 from aspr.sim.utils import _setup_logger
+from aspr.sim.output import RunStore
 from aspr.constants import NODE_TTL
 
 @click.command()
@@ -19,12 +20,22 @@ def cli(folder, n_colors, n_nodes, spawn_times_file, verbose):
 
   fe = FeatureExtractor(spawn_times_file, verbose)
 
+  if RunStore.exists(folder):
+    fe.extract_store(folder, dest_folder)
+    return
+
   for csv_file in csv_files: 
     feat_df = fe.extract(os.path.join(folder, csv_file))
     save_as = os.path.join(dest_folder, csv_file.replace('.csv', '-feat.csv'))
     feat_df.to_csv(save_as, index=False)
 
 
+def record_dtypes(columns):
+  """Colors, ttls and counts are integers, but scores can be fractional
+  (eg. with matrix interference)"""
+  return {col: float if col == 'score' else int for col in columns}
+
+
 class FeatureExtractor:
   """
   """
@@ -36,14 +47,27 @@ class FeatureExtractor:
     self.logger.debug('<init>')
 
   def extract(self, csv_f):
-    """Extract the decision points from the .csv log of a simulation"""
-    self.logger.info(f'extracting: {csv_f}')
-    df = pd.read_csv(csv_f, dtype=int)
-    df['decision'] = -1
-    df['loss'] = 0
-    for spawn_num, t_index in enumerate(self.spt):
-      df.loc[t_index-1, 'decision'] = df.loc[t_index, f'n{spawn_num}-color']
-      df.loc[t_index-1, 'loss'] = self.loss_for_decision(df, spawn_num, t_index)
+    """Extract the decision points from the .csv log of a simulation, or from
+    a DataFrame of a run read from a RunStore"""
+    if isinstance(csv_f, pd.DataFrame):
+      df = csv_f.astype(record_dtypes(csv_f.columns)).reset_index(drop=True)
+    else:
+      self.logger.info(f'extracting: {csv_f}')
+      columns = pd.read_csv(csv_f, nrows=0).columns
+      df = pd.read_csv(csv_f, dtype=record_dtypes(columns))
+    spt = np.asarray(self.spt)
+    spawn_nums = np.arange(len(spt))
+
+    # the color each node was assigned at its spawn time
+    color_cols = [f'n{spawn_num}-color' for spawn_num in spawn_nums]
+    decision = np.full(len(df.index), -1)
+    decision[spt-1] = df[color_cols].to_numpy()[spt, spawn_nums]
+
+    loss = np.zeros(len(df.index))
+    loss[spt-1] = self.losses_for_decisions(df['score'].to_numpy(), spt)
+
+    df['decision'] = decision
+    df['loss'] = loss
         
     n_active_cols = [col for col in df.columns if 'n-active' in col]
     total_ttl_cols = [col for col in df.columns if 'total-ttl' in col]
@@ -51,6 +75,34 @@ class FeatureExtractor:
     return feat_df
       
   
+  def extract_store(self, folder, dest_folder):
+    """Extract features for every run in the RunStore in folder, writing them
+    to a RunStore of features in dest_folder"""
+    self.logger.info(f'extracting store: {folder}')
+    return [self.extract_chunk(path, dest_folder)
+      for path in RunStore(folder).chunks()]
+
+
+  def extract_chunk(self, path, dest_folder):
+    """Extract features for the runs in one RunStore chunk, writing them to
+    a single chunk of features in dest_folder. Returns the path written."""
+    self.logger.info(f'extracting: {path}')
+    feat_store = RunStore(dest_folder, prefix='feat', chunk_size=None)
+    for run_id, df in RunStore(os.path.dirname(path)).read_chunk_runs(path):
+      feat_store.append(run_id, self.extract(df))
+    return feat_store.flush()
+
+
+  def losses_for_decisions(self, score, spt):
+    """Vectorized loss_for_decision() for every spawn time at once, using a
+    cumulative sum of the score to get the sum over each ttl window"""
+    ttl = NODE_TTL
+    csum = np.concatenate([[0], np.cumsum(score)])
+    start = spt
+    end = np.minimum(spt + ttl + 1, len(score))
+    return (csum[end] - csum[start]) / (end - start) - score[spt-1]
+
+
   def loss_for_decision(self, df, spawn_num, t_index):
     """compute the interference score (loss) due to decision
     
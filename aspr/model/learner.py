@@ -1,6 +1,27 @@
-import abc, os
+import abc, os, json, tempfile
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from aspr.sim.utils import _setup_logger
+from aspr.sim.output import RunStore, RUN_COL, file_signature
+from aspr.constants import FEAT_CACHE_DIR
+from os.path import join, exists, basename
+
+# dtypes of feature columns, by column name suffix
+FEAT_DTYPES = [
+  ('n-active', np.int16),
+  ('decision', np.int16),
+  ('total-ttl', np.int32),
+  ('score', np.float32),
+  ('loss', np.float32),
+]
+
+
+def feature_dtype(col):
+  for suffix, dtype in FEAT_DTYPES:
+    if col.endswith(suffix): return dtype
+  return np.float64
+
 
 class LearnerBase(abc.ABC):
 
@@ -21,14 +42,79 @@ class LearnerBase(abc.ABC):
   def load(self, path, **kwargs):
     pass
 
-  def read_f(self, folder):
-    files = [f for f in os.listdir(folder) if '.csv' in f]
-    for i, f in enumerate(files):
-        tmp_df = pd.read_csv(os.path.join(folder, f), dtype=float)
-        if i == 0:
-            df = tmp_df
-        else:
-            df = pd.concat([df, tmp_df], ignore_index=True)
-    
+  def feature_files(self, folder):
+    """The feature files in folder, and a function to read one of them: the
+    chunks of a RunStore if there are any, else the .csv files"""
+    store = RunStore(folder, prefix='feat')
+    paths = store.chunks()
+    if paths:
+      return paths, lambda path: store.read_chunk(path).drop(columns=RUN_COL)
+    paths = sorted(join(folder, f) for f in os.listdir(folder) if '.csv' in f)
+    return paths, pd.read_csv
+
+
+  def iter_f(self, folder, paths=None, chunk_size=100000):
+    """Yields (path, df) for the feature files in folder (or the given
+    subset of them), reading .csv files chunk_size rows at a time so only one
+    chunk is in memory at once"""
+    all_paths, read = self.feature_files(folder)
+    for path in all_paths if paths is None else paths:
+      if path.endswith('.csv'):
+        for df in pd.read_csv(path, chunksize=chunk_size): yield path, df
+      else:
+        yield path, read(path)
+
+
+  def read_f(self, folder, jobs=1, cache=False):
+    """Read every feature file in folder into one DataFrame.
+
+    Files are read by `jobs` threads and concatenated once, with compact
+    dtypes (see FEAT_DTYPES). With cache, the combined table is saved as a
+    .npy file per column in features-cache in folder. Later reads wrap
+    memory maps of these files without copying them, until the feature files
+    change.
+    """
+    paths, read = self.feature_files(folder)
+    signatures = {basename(path): file_signature(path) for path in paths}
+
+    cache_path = join(folder, FEAT_CACHE_DIR)
+    df = self.read_cache(cache_path, signatures) if cache else None
+    if df is None:
+      with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        dfs = list(pool.map(read, paths))
+      df = pd.concat(dfs, ignore_index=True)
+      df = df.astype({col: feature_dtype(col) for col in df.columns})
+      if cache: self.write_cache(df, cache_path, signatures)
+
     self.logger.info(f'Read {len(df.index)} rows, {len(df.columns)} columns')
     return df
+
+
+  def read_cache(self, path, signatures):
+    """The table cached in the folder at path, as a DataFrame backed by
+    read-only memory maps of its columns, or None if the cache is missing or
+    was built from different files"""
+    meta_path = join(path, 'meta.json')
+    if not exists(meta_path): return None
+    with open(meta_path, 'r') as f: meta = json.load(f)
+    if meta['signatures'] != signatures: return None
+    self.logger.info(f'Reading cache: {path}')
+    columns = {col: np.load(join(path, f'{col}.npy'), mmap_mode='r')
+      for col in meta['columns']}
+    return pd.DataFrame(columns, copy=False)
+
+
+  def write_cache(self, df, path, signatures):
+    """Save each column of df to a .npy file in the folder at path. Files are
+    written alongside and renamed into place, so other processes reading an
+    old cache keep valid memory maps."""
+    self.logger.info(f'Writing cache: {path}')
+    if not exists(path): os.makedirs(path)
+    meta_path = join(path, 'meta.json')
+    if exists(meta_path): os.remove(meta_path)
+    for col in df.columns:
+      fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f: np.save(f, df[col].to_numpy())
+      os.replace(tmp_path, join(path, f'{col}.npy'))
+    with open(meta_path, 'w') as f:
+      json.dump({'columns': list(df.columns), 'signatures': signatures}, f)
@@ -1,14 +1,17 @@
 from aspr.sim.utils import _setup_logger
 from aspr.sim.state import State, StateStatistics, History
 from aspr.model.learner import LearnerBase
-from aspr.constants import DATA, MODELS, MDL_EXT, OUTPUTS
+from aspr.sim.output import file_signature
+from aspr.constants import DATA, MODELS, MDL_EXT, OUTPUTS, LINREG_STATS_FN, \
+  LINREG_MODEL_FN
 from sklearn.linear_model import LogisticRegression, LinearRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
 import numpy as np
 import pandas as pd
-import os, joblib, click
-from os.path import join, exists
+from concurrent.futures import ThreadPoolExecutor
+import os, json, tempfile, joblib, click
+from os.path import join, exists, basename, dirname
 
 
 class LinearRegressorLearner(LearnerBase):
@@ -31,39 +34,98 @@ class LinearRegressorLearner(LearnerBase):
 
 
   def train(self, data_f, **kwargs):
+    if kwargs.get('stream', False):
+      return self.train_stream(data_f, kwargs.get('chunk_size', 100000))
     self.logger.info(f'Training from: {data_f}')
-    df = self.read_f(data_f)
+    df = self.read_f(data_f, jobs=kwargs.get('jobs', 1),
+      cache=kwargs.get('cache', False))
     df = df[[col for col in df.columns if col in self.features]]
 
     missing = [f for f in self.features if f not in df.columns]
     if missing:
       self.logger.warning(f'Missing features: {missing}')
 
+    # split by decision in one pass, rather than a scan per color
+    groups = dict(tuple(df.groupby('decision', sort=False)))
+    jobs = max(kwargs.get('jobs', 1), 1)
+    with ThreadPoolExecutor(max_workers=min(jobs, len(self.colors))) as pool:
+      fits = list(pool.map(lambda c: self.fit_color(groups.get(c, df.iloc[:0])),
+        self.colors))
+
     regrs = {}
+    for c, (regr, mse, r2) in zip(self.colors, fits):
+      self.logger.info(f'Trained color: {c}')
+      self.logger.debug(f'Coefficients: \n{regr.coef_}')
+      self.logger.debug(f'Mean squared error: {mse}')
+      self.logger.debug(f'Variance score: {r2}')
+      regrs[c] = regr
 
-    for c in self.colors:
-      self.logger.info(f'Training for color: {c}')
-      c_df = df.loc[df['decision'] == c,:]
-      y_col = 'loss'
-      X_cols = [col for col in c_df.columns if col != y_col]
+    self.save_all(regrs, self.model_out_f(data_f))
+    self.logger.info('Done!')
+    return regrs
 
-      X_train, X_test, y_train, y_test = train_test_split(
-        c_df[X_cols], c_df[y_col], test_size = 0.2, random_state = 42)
 
-      regr = LinearRegression()
-      regr.fit(X_train, y_train)
-      y_pred = regr.predict(X_test)
+  def fit_color(self, c_df):
+    """Fits a regressor to the rows of one color, holding out 20% of them.
+    Returns the regressor and its mean squared error and variance score on
+    the held out rows."""
+    y_col = 'loss'
+    X_cols = [col for col in c_df.columns if col != y_col]
 
-      self.logger.debug(f'Coefficients: \n{regr.coef_}')
-      self.logger.debug(f'Mean squared error: {mean_squared_error(y_test, y_pred)}')
-      self.logger.debug(f'Variance score: {r2_score(y_test, y_pred)}')
+    X_train, X_test, y_train, y_test = train_test_split(
+      c_df[X_cols], c_df[y_col], test_size = 0.2, random_state = 42)
 
-      out_f = self.model_out_f(data_f)
-      if not exists(out_f): os.makedirs(out_f)
-      self.save(regr, os.path.join(out_f, f'{c}{MDL_EXT}'))
-      regrs[c] = regr
+    regr = LinearRegression()
+    regr.fit(X_train, y_train)
+    y_pred = regr.predict(X_test)
+    return regr, mean_squared_error(y_test, y_pred), r2_score(y_test, y_pred)
+
+
+  def train_stream(self, data_f, chunk_size=100000):
+    """Fits each color's regressor from sufficient statistics accumulated
+    over the feature files chunk by chunk, so memory doesn't grow with the
+    size of the training set. Every row is used, and the fit is the same as
+    LinearRegression on all the rows at once.
+
+    The statistics are saved next to the models along with the (mtime, size)
+    of each file they include, so later calls only read new files. If a file
+    was changed or removed, they're accumulated from scratch."""
+    self.logger.info(f'Training from: {data_f} (streaming)')
+    out_f = self.model_out_f(data_f)
+    stats_path = join(out_f, LINREG_STATS_FN)
+    paths, _ = self.feature_files(data_f)
+    signatures = {basename(path): file_signature(path) for path in paths}
 
-    self.logger.info('Done!') 
+    stats = LinearStats.load(stats_path) if exists(stats_path) else None
+    if stats is not None and any(signatures.get(f) != sig
+      for f, sig in stats.signatures.items()):
+      self.logger.info('Feature files changed, training from scratch')
+      stats = None
+    done = stats.signatures if stats is not None else {}
+    new = [path for path in paths if basename(path) not in done]
+    self.logger.info(f'Reading {len(new)} new of {len(paths)} feature files')
+
+    for path, df in self.iter_f(data_f, new, chunk_size):
+      if stats is None:
+        x_cols = [f for f in self.features if f != 'loss' and f in df.columns]
+        missing = [f for f in self.features if f not in df.columns]
+        if missing:
+          self.logger.warning(f'Missing features: {missing}')
+        stats = LinearStats(self.colors, x_cols)
+      stats.update(df)
+      stats.signatures[basename(path)] = signatures[basename(path)]
+    if stats is None:
+      raise ValueError(f'No feature files in {data_f}')
+
+    regrs = {}
+    for c in self.colors:
+      self.logger.info(f'Training for color: {c} ({int(stats.n[c])} rows)')
+      regrs[c] = stats.solve(c)
+      self.logger.debug(f'Coefficients: \n{regrs[c].coef_}')
+    self.save_all(regrs, out_f)
+    stats.save(stats_path)
+
+    self.logger.info('Done!')
     return regrs
 
 
@@ -72,25 +134,193 @@ class LinearRegressorLearner(LearnerBase):
     return out_f
 
 
+  @property
+  def state_features(self):
+    """Features of the state, in the order of the compiled coefficients"""
+    return [f'c{c}-n-active' for c in self.colors] + \
+      [f'c{c}-total-ttl' for c in self.colors]
+
+
+  def compile(self, regrs):
+    """Pull the coefficients of each color's regressor into one matrix with a
+    row per color, and columns for the state features, the decision and the
+    intercept, such that the predicted loss for all colors given state
+    features x is:
+      W[:, :-2] @ x + W[:, -2] * colors + W[:, -1]"""
+    state_features = self.state_features
+    n = len(state_features)
+    weights = np.zeros((len(self.colors), n + 2))
+    for i, c in enumerate(self.colors):
+      regr = regrs[c]
+      names = getattr(regr, 'feature_names_in_', state_features + ['decision'])
+      for name, w in zip(names, np.ravel(regr.coef_)):
+        if name == 'decision':
+          weights[i, n] = w
+        else:
+          weights[i, state_features.index(name)] = w
+      weights[i, n + 1] = regr.intercept_
+    return weights
+
+
+  def save_all(self, regrs, out_f):
+    """Write the regressors of every color to out_f, as one model file"""
+    if not exists(out_f): os.makedirs(out_f)
+    self.save(regrs, join(out_f, LINREG_MODEL_FN))
+
+
   def save(self, model, path, **kwargs):
+    """Write a dict of each color's regressor to a model file at path"""
     self.logger.info(f'Saving: {path}')
-    joblib.dump(model, path)
+    write_model(path, self.compile(model), {
+      'model': 'linreg',
+      'colors': [int(c) for c in self.colors],
+      'features': self.state_features + ['decision', 'intercept']})
 
 
   def load(self, exp_f, **kwargs):
+    """The compiled coefficients (see compile()) of the model trained on
+    exp_f, memory-mapped from its model file. Models saved as one .joblib
+    file per color are loaded and compiled instead."""
     path = join(OUTPUTS, exp_f, f'nc{len(self.colors)}', MODELS, 'linreg')
+    model_path = join(path, LINREG_MODEL_FN)
+    if exists(model_path):
+      self.logger.info(f'Loading: {model_path}')
+      meta, weights = read_model(model_path)
+      expected = self.state_features + ['decision', 'intercept']
+      if meta['colors'] != list(self.colors) or meta['features'] != expected:
+        raise ValueError(f'{model_path} was trained for colors {meta["colors"]} '
+          f'and features {meta["features"]}, expected colors {list(self.colors)} '
+          f'and features {expected}')
+      return weights
+
     regrs = {}
     for c in self.colors:
       f = join(path, f'{c}{MDL_EXT}')
       self.logger.info(f'Loading: {f}')
       regrs[c] = joblib.load(f)
-    return regrs
+    return self.compile(regrs)
+
+
+class LinearStats:
+  """Sufficient statistics for a least squares fit of loss on the features,
+  for each color: the number of rows, the mean of [X, y], and the centered
+  cross products [X, y]ᵀ[X, y] (from which XᵀX and Xᵀy about the means
+  follow). Chunks are merged with the pairwise update of Chan et al., which
+  is exact and avoids the cancellation of accumulating raw sums.
+
+  Parameters
+  ----------
+
+  colors (list) : Colors, as in the decision column
+
+  x_cols (list) : Feature columns to regress on
+  """
+  def __init__(self, colors, x_cols):
+    self.colors = list(colors)
+    self.x_cols = list(x_cols)
+    p = len(self.x_cols) + 1
+    self.n = np.zeros(len(self.colors))
+    self.mean = np.zeros((len(self.colors), p))
+    self.m2 = np.zeros((len(self.colors), p, p))
+    self.signatures = {}
+
+
+  def update(self, df):
+    """Add the rows of a chunk of features"""
+    data = df[self.x_cols + ['loss']].to_numpy(dtype=np.float64)
+    decision = df['decision'].to_numpy()
+    for i, c in enumerate(self.colors):
+      rows = data[decision == c]
+      if not len(rows): continue
+      n_b, mean_b = len(rows), rows.mean(axis=0)
+      centered = rows - mean_b
+      m2_b = centered.T @ centered
+      n_a, n = self.n[i], self.n[i] + n_b
+      delta = mean_b - self.mean[i]
+      self.m2[i] += m2_b + np.outer(delta, delta) * (n_a * n_b / n)
+      self.mean[i] += delta * (n_b / n)
+      self.n[i] = n
+
+
+  def solve(self, c):
+    """A fitted LinearRegression for color c"""
+    i = self.colors.index(c)
+    if not self.n[i]:
+      raise ValueError(f'No rows with decision {c}')
+    xtx, xty = self.m2[i, :-1, :-1], self.m2[i, :-1, -1]
+    coef = np.linalg.lstsq(xtx, xty, rcond=None)[0]
+    regr = LinearRegression()
+    regr.coef_ = coef
+    regr.intercept_ = float(self.mean[i, -1] - self.mean[i, :-1] @ coef)
+    regr.n_features_in_ = len(self.x_cols)
+    regr.feature_names_in_ = np.asarray(self.x_cols, dtype=object)
+    return regr
+
+
+  def save(self, path):
+    np.savez(path, colors=np.asarray(self.colors), x_cols=np.asarray(self.x_cols),
+      n=self.n, mean=self.mean, m2=self.m2,
+      signatures=np.asarray(json.dumps(self.signatures)))
+    return path
+
 
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as data:
+      stats = cls(data['colors'].tolist(), data['x_cols'].tolist())
+      stats.n, stats.mean, stats.m2 = data['n'], data['mean'], data['m2']
+      stats.signatures = json.loads(str(data['signatures']))
+    return stats
 
 
+# Model files start with MODEL_MAGIC, the format version (uint16), and the
+# length of a JSON header (uint32), all little-endian. The header is padded
+# so that the weights, a C-ordered float64 matrix, start on a 64 byte
+# boundary, and can be memory-mapped in place.
+MODEL_MAGIC = b'ASPRMDL'
+MODEL_VERSION = 1
+MODEL_ALIGN = 64
 
- 
 
+def write_model(path, weights, meta):
+  """Write a weight matrix and a dict of metadata to one model file.
 
+  The file is written alongside and then renamed over path, so processes
+  which have the old file memory-mapped keep reading it intact."""
+  weights = np.ascontiguousarray(weights, dtype='<f8')
+  header = dict(meta, version=MODEL_VERSION, dtype='<f8', shape=list(weights.shape))
+  header = json.dumps(header).encode()
+  prefix = len(MODEL_MAGIC) + 6
+  header += b' ' * (-(prefix + len(header)) % MODEL_ALIGN)
+  fd, tmp_path = tempfile.mkstemp(dir=dirname(path) or '.', suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(MODEL_MAGIC)
+      f.write(np.array([MODEL_VERSION], dtype='<u2').tobytes())
+      f.write(np.array([len(header)], dtype='<u4').tobytes())
+      f.write(header)
+      f.write(weights.tobytes())
+    os.replace(tmp_path, path)
+  except BaseException:
+    os.remove(tmp_path)
+    raise
+  return path
 
 
+def read_model(path):
+  """The metadata and memory-mapped (read-only) weights of a model file, as
+  (dict, np.memmap)"""
+  with open(path, 'rb') as f:
+    magic = f.read(len(MODEL_MAGIC))
+    if magic != MODEL_MAGIC:
+      raise ValueError(f'Not a model file: {path}')
+    version = int(np.frombuffer(f.read(2), dtype='<u2')[0])
+    if version > MODEL_VERSION:
+      raise ValueError(f'{path} has format version {version}, '
+        f'only versions up to {MODEL_VERSION} are supported')
+    n_header = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    meta = json.loads(f.read(n_header))
+  offset = len(MODEL_MAGIC) + 6 + n_header
+  weights = np.memmap(path, dtype=meta['dtype'], mode='r', offset=offset,
+    shape=tuple(meta['shape']))
+  return meta, weights
@@ -0,0 +1,229 @@
+import numpy as np
+import time
+from aspr.sim.state import ArrayState, StateView, records_to_df
+from aspr.sim.utils import _setup_logger
+from aspr.sim import profiler
+from aspr.constants import NODE_TTL
+
+class BatchScenario:
+  """Runs many scenarios which share the same spawn times in lockstep.
+
+  Every run activates the same node at the same time, and TTLs only depend
+  on when a node was activated, so node TTLs (and which nodes are active)
+  are shared by the whole batch. Only the colors differ between runs, and
+  these are stored as an R x n matrix. Ticks, activations and scoring are
+  applied to the whole batch at once.
+
+  Decisions are made with the decision model's decide_batch(), which falls
+  back to calling decide() for each run.
+
+  Parameters
+  ----------
+
+  n_runs : int
+    Number of scenarios to run together.
+
+  n_nodes : int
+    Number of nodes which may be activated during each scenario
+
+  spt : list(int)
+    The times at which nodes will be activated.
+
+  colors : list(int)
+    The available colors for node activation
+
+  dec_model : DecisionModel
+    The decision model to use when choosing which color to assign an activating node.
+
+  int_model : InterferenceModel
+    The model to use for evaluating the interference score between two active nodes.
+
+  name : str
+    The name for the logger to use.
+
+  verbose : int
+    The log level. {0: None, 1: Info, 2: Debug}
+  """
+  def __init__(self, n_runs, n_nodes, spt, colors, dec_model, int_model, name,
+    verbose=0):
+    self.n_runs = n_runs
+    self.n_nodes = n_nodes
+    self.spt = spt
+    self.colors = colors
+    self.dec_model = dec_model
+    self.int_model = int_model
+    self.name = name
+    self.verbose = verbose
+    self.logger = _setup_logger(self, verbose=verbose)
+
+    k = len(colors)
+    self.t = 0
+    self.actvn_cnt = 0
+    self.node_colors = np.full((n_runs, n_nodes), -1, dtype=int)
+    self.node_ttls = np.full(n_nodes, NODE_TTL, dtype=int)
+    self.node_active = np.zeros(n_nodes, dtype=bool)
+    self.n_active = np.zeros((n_runs, k), dtype=int)
+    self.ttl_total = np.zeros((n_runs, k), dtype=int)
+    self._records = []
+    self.record()
+    self.logger.debug('<init>')
+
+
+  def run(self):
+    self.logger.info('Starting...')
+    next_spawn = self.spt.pop(0)
+    prof = profiler.active
+
+    while True:
+      if prof: t0 = time.perf_counter()
+      self.tick()
+      if prof:
+        t0 = prof.lap('tick', t0)
+        prof.count('ticks', self.n_runs)
+
+      if self.t == next_spawn:
+        decisions = self.dec_model.decide_batch(self)
+        if prof:
+          t0 = prof.lap('decide', t0)
+          prof.count('decisions', self.n_runs)
+        self.activate(decisions)
+        if prof: t0 = prof.lap('activate', t0)
+        if self.spt:
+          next_spawn = self.spt.pop(0)
+
+      self.record()
+      if prof: prof.lap('record', t0)
+
+      if self.all_nodes_expired():
+        return self.end_run('All nodes TTL expired.')
+
+      if not self.spt and self.count_active_nodes() == 0:
+        return self.end_run('All spawns complete.')
+
+
+  def end_run(self, m):
+    # perform one last tick and record
+    self.tick()
+    self.record()
+    self.logger.info('Simulation complete: %s' % m)
+
+
+  def tick(self):
+    self.t += 1
+    expire = self.node_active & (self.node_ttls <= 0)
+    runs = np.arange(self.n_runs)
+    for i in np.flatnonzero(expire):
+      self.n_active[runs, self.node_colors[:, i]] -= 1
+    self.node_colors[:, expire] = -1
+    self.node_active &= ~expire
+    self.node_ttls[self.node_active] -= 1
+    self.ttl_total -= self.n_active
+
+
+  def activate(self, decisions):
+    """Activate the next node in every run, with one color per run"""
+    if self.actvn_cnt >= self.n_nodes:
+      self.logger.debug('All nodes already activated. Continuing.')
+      return
+    i = self.actvn_cnt
+    decisions = np.asarray(decisions)
+    runs = np.arange(self.n_runs)
+    self.node_colors[:, i] = decisions
+    self.node_active[i] = True
+    self.n_active[runs, decisions] += 1
+    self.ttl_total[runs, decisions] += self.node_ttls[i]
+    self.actvn_cnt += 1
+
+
+  def score(self):
+    """Current interference score of each run"""
+    if profiler.active: profiler.active.count('scores', self.n_runs)
+    if self.int_model.aggregate:
+      return np.asarray(self.int_model.score_counts(self.n_active), dtype=float)
+    return np.array([self.state(r).score() for r in range(self.n_runs)])
+
+
+  def state(self, r):
+    """The current state of run r as an ArrayState"""
+    return ArrayState().init(self.n_nodes, self.int_model, self.colors,
+      verbose=self.verbose).load(self.t, self.actvn_cnt, self.node_colors[r],
+      self.node_ttls)
+
+
+  def count_active_nodes(self):
+    return int(np.count_nonzero(self.node_active))
+
+
+  def all_nodes_expired(self):
+    return bool(np.all(self.node_ttls <= 0))
+
+
+  def record(self):
+    self._records.append((self.t, self.actvn_cnt, self.node_colors.copy(),
+      self.node_ttls.copy(), self.score(), self.n_active.copy(),
+      self.ttl_total.copy()))
+
+
+  def view(self, r, i = -1):
+    """Read-only view of recorded tick i of run r"""
+    t, actvn_cnt, node_colors, node_ttls, score, n_active, ttl_total = \
+      self._records[i]
+    cols = []
+    for col in [node_colors[r], node_ttls, n_active[r], ttl_total[r]]:
+      col = col.view()
+      col.flags.writeable = False
+      cols.append(col)
+    node_colors, node_ttls, n_active, ttl_total = cols
+    return StateView(t, actvn_cnt, node_colors, node_ttls, float(score[r]),
+      n_active, ttl_total)
+
+
+  def histories(self):
+    """A History-like object for each run, for decision models which don't
+    implement decide_batch()"""
+    return [BatchRunHistory(self, r) for r in range(self.n_runs)]
+
+
+  def score_runs(self):
+    """Total score of each run over all recorded ticks"""
+    return np.sum([rec[4] for rec in self._records], axis=0)
+
+
+  def to_df(self, r):
+    """DataFrame of run r, in the same layout as Scenario.to_df()"""
+    t, _, node_colors, node_ttls, score, n_active, ttl_total = \
+      zip(*self._records)
+    return records_to_df(self.colors, np.array(t),
+      np.stack([c[r] for c in node_colors]), np.stack(node_ttls),
+      np.array([s[r] for s in score]), np.stack([n[r] for n in n_active]),
+      np.stack([ttl[r] for ttl in ttl_total]))
+
+
+class BatchRunHistory:
+  """Read access to a single run of a BatchScenario, with the same interface
+  as History"""
+  def __init__(self, batch, r):
+    self.batch = batch
+    self.r = r
+    self.colors = batch.colors
+    self.int_model = batch.int_model
+
+
+  def __len__(self):
+    return len(self.batch._records)
+
+
+  def view(self, i = -1):
+    return self.batch.view(self.r, i)
+
+
+  def read(self, i = None):
+    if i != None: return self._state(i)
+    return [self._state(j) for j in range(len(self))]
+
+
+  def _state(self, i):
+    v = self.view(i)
+    return ArrayState().init(self.batch.n_nodes, self.batch.int_model,
+      self.batch.colors, verbose=self.batch.verbose).load(v.t, v.actvn_cnt,
+      v.node_colors, v.node_ttls)
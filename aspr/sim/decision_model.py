@@ -2,8 +2,10 @@ import numpy as np
 import pandas as pd
 from aspr.model.linreg import LinearRegressorLearner
 from aspr.sim.state import State, StateStatistics, History
-from aspr.sim.utils import _setup_logger
-import copy, os, abc, weakref
+from aspr.sim.utils import _setup_logger, parse_model_args
+from aspr.constants import NODE_TTL
+from collections import OrderedDict
+import copy, os, abc, weakref, time, logging
 
 class DecisionModelBase(abc.ABC):
   """"""
@@ -12,6 +14,8 @@ class DecisionModelBase(abc.ABC):
     self.name = self.__class__.__name__
     self.colors = colors
     self.logger = _setup_logger(self, verbose = verbose)
+    # checked once, so debug messages aren't formatted when they're disabled
+    self._debug = self.logger.isEnabledFor(logging.DEBUG)
 
 
   @abc.abstractmethod
@@ -19,73 +23,157 @@ class DecisionModelBase(abc.ABC):
     pass
 
 
+  def decide_batch(self, batch):
+    """Decide for every run of a BatchScenario at once. Falls back to calling
+    decide() on each run's history."""
+    return np.array([self.decide(history) for history in batch.histories()])
+
+
+  def reset(self):
+    """Called before each run, so that runs don't depend on the ones before"""
+    pass
+
+
+  def stats(self):
+    """Counters accumulated since the last call to reset_stats(). Counters
+    from several processes are combined by summing them."""
+    return {}
+
+
+  def reset_stats(self):
+    pass
+
+
+def active_counts_by_step(node_colors, node_ttls, k, steps):
+  """counts[s, c] is the number of the given active nodes of color c which
+  are still active s ticks from now, for s in range(steps). A node with ttl
+  x is active for s <= x."""
+  hist = np.zeros((k, steps + 1), dtype=int)
+  np.add.at(hist, (node_colors, np.minimum(node_ttls, steps)), 1)
+  return np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, :steps].T
+
+
 class DecisionModelFactory:
   """"""
   @staticmethod
-  def options(): return ['greedy', 'random', 'rrobin', 'linreg']
+  def options(): return ['greedy', 'random', 'rrobin', 'linreg', 'beam']
 
 
-  def get(self, name, colors, aarg, verbose):
+  def get(self, name, colors, aarg, verbose, spt=None):
     if name == 'greedy':
-      return GreedyDecision(colors, aarg, verbose)
+      args = parse_model_args(aarg, 'ps')
+      return GreedyDecision(colors, args.get('ps'), verbose, 
+        cache_size = int(args.get('cache', GreedyDecision.CACHE_SIZE)),
+        mode = args.get('mode', 'sim'))
     if name == 'random':
       return RandomDecision(colors, verbose)
     if name == 'rrobin':
       return RoundRobinDecision(colors, verbose)
     if name == 'linreg':
       return LinearRegressor(colors, aarg, verbose)
+    if name == 'beam':
+      args = parse_model_args(aarg, 'width')
+      return BeamDecision(colors, spt, verbose,
+        width = int(args.get('width', BeamDecision.WIDTH)),
+        depth = int(args.get('depth', BeamDecision.DEPTH)))
 
 
 class LinearRegressor(DecisionModelBase, LinearRegressorLearner):
-  """
+  """Chooses the color with the lowest loss predicted by the trained per-color
+  linear regressors.
+
+  The regressors' coefficients are compiled into one matrix when the model
+  is saved, so every color is scored with a single matrix-vector product
+  over the state's per-color active counts and ttl totals. The matrix is
+  memory-mapped from the model file, so processes running the same model
+  share one copy.
   """
   def __init__(self, colors, exp_f, verbose=0):
     super().__init__(colors, verbose)
     super().__init__(colors, verbose)
     
     self.colors = colors
-    self.regrs = self.load(exp_f)
-    self.logger.debug(f'<init>: colors={colors}, model={self.regrs}')
+    weights = self.load(exp_f)
+    n = 2 * len(colors)
+    self.coef, self.dec_coef, self.intercept = \
+      weights[:, :n], weights[:, n], weights[:, n + 1]
+    self.logger.debug(f'<init>: colors={colors}, model={exp_f}')
 
 
-  def decide(self, history):
-    # get features from state
-    feat = self.get_feat_df(history)
-    df = pd.DataFrame({k: [v] for k,v in feat.items()})
+  def predict(self, x):
+    """Predicted loss of each color, for state features x. If x is a matrix
+    of one row per state, returns a matrix of one row per state."""
+    return x @ self.coef.T + self.dec_coef * np.asarray(self.colors) + self.intercept
 
-    df = df[[col for col in df.columns if col in self.features]]
 
-    self.logger.debug(f'Predicting: {df.head()}')
+  def decide(self, history):
+    preds = self.predict(self.get_feat_vector(history.view(-1)))
+    decision = int(np.argmin(preds))
+    if self._debug:
+      self.logger.debug('Predicted loss = %s, decision = %s', preds, decision)
+    return decision
 
-    preds = []
-    for c in self.colors:
-      df['decision'] = c
-      pred_loss = self.regrs[c].predict(df)
-      preds.append(pred_loss)
 
-    decision = preds.index(min(preds))
-    self.logger.debug(f'Predicted loss = {preds}, decision = {decision}')
-    return decision
+  def decide_batch(self, batch):
+    x = np.stack([self.get_feat_vector(batch.view(r)) 
+      for r in range(batch.n_runs)])
+    decisions = np.argmin(self.predict(x), axis=1)
+    if self._debug: self.logger.debug('Decisions = %s', decisions)
+    return decisions
 
 
-  def get_feat_df(self, history):
-    state = history.read(-1)
-    feat = state.to_dict()
-    return feat
+  def get_feat_vector(self, view):
+    """Active counts followed by ttl totals of each color"""
+    return np.concatenate([view.n_active, view.ttl_total])
 
 
 class GreedyDecision(DecisionModelBase):
   """Will choose the color that results in the lowest cumulative
   score over the next ps ticks.
+
+  With an aggregate interference model, which scores from the colors of
+  the nodes alone, the look-ahead scores only depend on the colors and ttls
+  of the active nodes (and whether a node is left to activate), so they are
+  memoized in an LRU cache of up to cache_size states keyed on that
+  signature. Other interference models may depend on which nodes are
+  active, so their look-aheads are never cached. The cache lives on the
+  model, so it is shared across the seeds of an Experiment. Set cache_size
+  to 0 to disable it.
+
+  With mode='analytic', the look-ahead is computed in closed form from the
+  ttl distribution of the active nodes of each color, rather than by copying
+  the state and ticking it ps times. This requires an interference model
+  with an aggregate score, and gives the same scores as mode='sim'.
+
+  Decision model args: 'ps=<ticks>,cache=<cache_size>,mode=<sim|analytic>',
+  or just '<ticks>'
   """
-  def __init__(self, colors, ps, verbose=0):
+  CACHE_SIZE = 10000
+  MODES = ['sim', 'analytic']
+
+  def __init__(self, colors, ps, verbose=0, cache_size=CACHE_SIZE, mode='sim'):
     super().__init__(colors, verbose)
+    if mode not in self.MODES:
+      raise ValueError(f'Unknown look-ahead mode: {mode}. Options: {self.MODES}')
     self.ps = int(ps) if ps != None else 1
-    self.logger.debug('<init>: colors={}, ps={}, verbose={}'.format(
-      self.colors, self.ps, verbose
+    self.mode = mode
+    self.cache_size = cache_size
+    self._cache = OrderedDict()
+    self.reset_stats()
+    self.logger.debug('<init>: colors={}, ps={}, cache_size={}, verbose={}'.format(
+      self.colors, self.ps, self.cache_size, verbose
     ))
 
 
+  def stats(self):
+    return {'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+
+  def reset_stats(self):
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+
   def peek_cum_score(self, state, color, ps):
     temp_state = state.copy()
     temp_state.activate(color)
@@ -108,14 +196,189 @@ class GreedyDecision(DecisionModelBase):
     return min_color
 
 
+  def lookahead_key(self, view):
+    """Signature of the state one tick after the recorded row `view`: the
+    sorted (color, ttl) of nodes still active after the tick, and whether
+    any node is left to activate"""
+    alive = (view.node_colors != -1) & (view.node_ttls > 0)
+    active = sorted(zip(view.node_colors[alive].tolist(), 
+      (view.node_ttls[alive] - 1).tolist()))
+    return tuple(active), view.actvn_cnt < len(view.node_colors)
+
+
+  def lookahead(self, history):
+    """Cumulative score of each color over the next ps ticks"""
+    # the cache key assumes the score depends only on colors
+    cache = self.cache_size and history.int_model.aggregate
+    if cache:
+      key = self.lookahead_key(history.view(-1))
+      if key in self._cache:
+        self.cache_hits += 1
+        self._cache.move_to_end(key)
+        return self._cache[key]
+      self.cache_misses += 1
+
+    if self.mode == 'analytic' and history.int_model.aggregate:
+      scores = self.analytic_cum_scores(history.view(-1), history.int_model)
+    else:
+      state = history.read(-1)
+      state.tick() # look one step ahead
+      scores = [(c, self.peek_cum_score(state, c, self.ps))
+        for c in self.colors]
+
+    if cache:
+      self._cache[key] = scores
+      if len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+    return scores
+
+
+  def analytic_cum_scores(self, view, int_model):
+    """Closed form of peek_cum_score() for every color, from the recorded
+    row `view` (before the look-ahead tick).
+
+    After the look-ahead tick, a node with ttl x is still active s ticks
+    later iff s <= x. So the number of active nodes of color c at step s is
+    a suffix sum of the ttl histogram of color c. Each step is scored once
+    without the new node, and the new node adds add_delta() of the counts
+    while it is active, so this is O(n + k.ps) for binary interference.
+    """
+    k = len(self.colors)
+    alive = (view.node_colors != -1) & (view.node_ttls > 0)
+    counts = active_counts_by_step(view.node_colors[alive],
+      view.node_ttls[alive] - 1, k, self.ps)
+
+    # step_scores[s, c]: score at step s, including the new node of color c
+    base = np.asarray(int_model.score_counts(counts), dtype=float)
+    step_scores = np.repeat(base[:, None], k, axis=1)
+    if view.actvn_cnt < len(view.node_colors):
+      steps = min(self.ps, NODE_TTL + 1)
+      step_scores[:steps] += int_model.add_deltas(counts[:steps])
+    totals = step_scores.sum(axis=0)
+    return [(c, float(totals[i])) for i, c in enumerate(self.colors)]
+
+
   def decide(self, history):
-    state = history.read()[-1]
-    state.tick() # look one step ahead
-    scores = [(c, self.peek_cum_score(state, c, self.ps))
-      for c in self.colors]
+    scores = self.lookahead(history)
     decision = self.min_score_color(scores)
-    self.logger.debug(f'Scores: {scores}')
-    self.logger.debug(f'Selected: c={decision}')
+    if self._debug:
+      self.logger.debug('Scores: %s', scores)
+      self.logger.debug('Selected: c=%s', decision)
+    return decision
+
+
+class BeamDecision(DecisionModelBase):
+  """Searches over colorings of the next `depth` known spawns, keeping the
+  `width` cheapest partial colorings at each spawn, and chooses the first
+  color of the cheapest coloring found.
+
+  The cost of a coloring is the interference from the current spawn until
+  the next one, and so on, until the last node's ttl runs out. Future
+  spawns are not simulated by ticking States: nodes are advanced between
+  spawns with active_counts_by_step(). Partial colorings with the same set
+  of active (color, ttl) are merged.
+
+  Interference never decreases as spawns are added, so the cost of a
+  partial coloring is a lower bound on the cost of any completion of it.
+  Partial colorings which can't beat a greedy coloring of the same spawns
+  are pruned.
+
+  Decision model args: 'width=<beam width>,depth=<spawns>'
+  """
+  WIDTH = 4
+  DEPTH = 3
+
+  def __init__(self, colors, spt, verbose=0, width=WIDTH, depth=DEPTH):
+    super().__init__(colors, verbose)
+    self.spt = sorted(spt)
+    self.width = width
+    self.depth = depth
+    self.reset_stats()
+    self.logger.debug(f'<init>: colors={colors}, width={width}, depth={depth}')
+
+
+  def stats(self):
+    return {'decisions': self.decisions, 'decide_time': self.decide_time,
+      'pruned': self.pruned}
+
+
+  def reset_stats(self):
+    self.decisions = 0
+    self.decide_time = 0.0
+    self.pruned = 0
+
+
+  def advance(self, node_colors, node_ttls, color, ticks, int_model):
+    """Activate a node of `color` and advance `ticks`. Returns the score
+    summed over those ticks, and the colors and ttls of the nodes still
+    active afterwards."""
+    node_colors = np.append(node_colors, color)
+    node_ttls = np.append(node_ttls, NODE_TTL)
+    counts = active_counts_by_step(node_colors, node_ttls, len(self.colors), ticks)
+    cost = float(np.sum(int_model.score_counts(counts)))
+    alive = node_ttls >= ticks
+    return cost, node_colors[alive], node_ttls[alive] - ticks
+
+
+  def greedy(self, node_colors, node_ttls, gaps, int_model):
+    """Colors each spawn with its cheapest color. Returns (cost, colors)"""
+    cost, path = 0.0, ()
+    for gap in gaps:
+      options = [self.advance(node_colors, node_ttls, c, gap, int_model) + (c,)
+        for c in self.colors]
+      step_cost, node_colors, node_ttls, c = min(options, key=lambda o: o[0])
+      cost += step_cost
+      path += (c,)
+    return cost, path
+
+
+  def search(self, node_colors, node_ttls, gaps, int_model):
+    """Beam search over colorings of the spawns separated by `gaps`.
+    Returns (cost, colors) of the best coloring found."""
+    best = self.greedy(node_colors, node_ttls, gaps, int_model)
+    beam = [(0.0, (), node_colors, node_ttls)]
+    for gap in gaps:
+      children = {}
+      for cost, path, cs, ts in beam:
+        for c in self.colors:
+          step_cost, child_cs, child_ts = self.advance(cs, ts, c, gap, int_model)
+          child = (cost + step_cost, path + (c,), child_cs, child_ts)
+          if child[:2] >= best:
+            self.pruned += 1
+            continue
+          key = tuple(sorted(zip(child_cs.tolist(), child_ts.tolist())))
+          if key not in children or child[:2] < children[key][:2]:
+            children[key] = child
+      beam = sorted(children.values(), key=lambda b: b[:2])[:self.width]
+      if not beam: return best
+    return min(best, beam[0][:2])
+
+
+  def decide(self, history):
+    start = time.perf_counter()
+    view = history.view(-1)
+    int_model = history.int_model
+    if not int_model.aggregate:
+      raise ValueError('BeamDecision requires an interference model with an aggregate score')
+
+    # the spawn happens one tick after the recorded row
+    t = view.t + 1
+    alive = (view.node_colors != -1) & (view.node_ttls > 0)
+    node_colors = view.node_colors[alive].astype(int)
+    node_ttls = view.node_ttls[alive].astype(int) - 1
+
+    n_left = len(view.node_colors) - view.actvn_cnt
+    spawns = [t] + [s for s in self.spt if s > t][:max(min(self.depth, n_left), 1) - 1]
+    gaps = np.diff(spawns + [spawns[-1] + NODE_TTL + 1])
+
+    cost, path = self.search(node_colors, node_ttls, gaps, int_model)
+    decision = path[0]
+
+    elapsed = time.perf_counter() - start
+    self.decisions += 1
+    self.decide_time += elapsed
+    if self._debug:
+      self.logger.debug('Selected: c=%s, path=%s, cost=%s, time=%.6fs',
+        decision, path, cost, elapsed)
     return decision
 
 
@@ -128,10 +391,17 @@ class RandomDecision(DecisionModelBase):
 
   def decide(self, history):
     decision = self.colors[np.random.randint(0, len(self.colors))]
-    self.logger.debug(f'Selected: c={decision}')
+    if self._debug: self.logger.debug('Selected: c=%s', decision)
     return decision
 
 
+  def decide_batch(self, batch):
+    decisions = np.asarray(self.colors)[
+      np.random.randint(0, len(self.colors), size=batch.n_runs)]
+    if self._debug: self.logger.debug('Selected: c=%s', decisions)
+    return decisions
+
+
 class RoundRobinDecision(DecisionModelBase):
   """Will iterate through possible colors with each call to decide()"""
   
@@ -140,8 +410,16 @@ class RoundRobinDecision(DecisionModelBase):
     self.next = -1
 
 
+  def reset(self):
+    self.next = -1
+
+
   def decide(self, history):
     self.next = (self.next + 1) % len(self.colors)
     decision = self.colors[self.next]
-    self.logger.debug(f'Selected: c={decision}')
-    return decision
\ No newline at end of file
+    if self._debug: self.logger.debug('Selected: c=%s', decision)
+    return decision
+
+
+  def decide_batch(self, batch):
+    return np.full(batch.n_runs, self.decide(None))
\ No newline at end of file
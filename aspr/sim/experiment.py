@@ -1,12 +1,20 @@
 """Main entry point to perform runs of simulation"""
 
 from aspr.sim.scenario import Scenario
+from aspr.sim.batch import BatchScenario
 from aspr.sim.decision_model import DecisionModelFactory
 from aspr.sim.interference_model import InterferenceModelFactory
 from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.state import StateFactory
+from aspr.sim.output import RunStore, CsvSink
 from aspr.sim.utils import _setup_logger
-from aspr.constants import OUTPUTS, SPT_FN, DATA
-import random, os, click
+from aspr.sim import profiler
+from aspr.sim.trace import TraceSink, TRACE_EXT
+from aspr.constants import OUTPUTS, SPT_FN, DATA, PROFILE_FN
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+import numpy as np
+import random, os, time, math, click
 from os.path import join, exists
 
 @click.command()
@@ -17,10 +25,19 @@ from os.path import join, exists
 @click.option('-da', '--decision-model-args', default=None, help='Additional arguments for decision model.')
 @click.option('-im', '--interference-model', default='binary', type=click.Choice(InterferenceModelFactory.options()))
 @click.option('-ia', '--interference-model-args', default=None, help='Additional arguments for interference model.')
+@click.option('-se', '--state-engine', default='object', type=click.Choice(StateFactory.options()), help='State representation to simulate with.')
+@click.option('-ed', '--event-driven', is_flag=True, help='Skip over ticks in which nothing spawns or expires.')
+@click.option('-j', '--jobs', default=1, help='Number of worker processes to spread runs across.')
+@click.option('-bs', '--batch-size', default=1, help='Number of runs to simulate together in lockstep.')
+@click.option('-of', '--output-format', default='csv', type=click.Choice(['csv', 'npz']), help='Write one .csv per run, or append all runs to a chunked .npz store.')
+@click.option('-st', '--stream', is_flag=True, help='Write the rows of each .csv as the run produces them, rather than keeping the run in memory.')
+@click.option('-p', '--profile', is_flag=True, help='Time each phase of the runs, and write a summary to profile.json.')
+@click.option('-tr', '--trace', is_flag=True, help='Write the ticks and spawns of each run to a .trace.jsonl file.')
 @click.option('-b', '--base-seed', default=0, help='Random seed to use')
 @click.option('-v', '--verbose', count=True, help='Log level. Options: -v -vv')
 def cli(spawn_times, n_colors, n_runs, decision_model, decision_model_args, 
-  interference_model, interference_model_args, base_seed, verbose):
+  interference_model, interference_model_args, state_engine, event_driven,
+  jobs, batch_size, output_format, stream, profile, trace, base_seed, verbose):
   click.echo("Running aspr.experiment.cli")
 
   exp = Experiment(
@@ -31,6 +48,14 @@ def cli(spawn_times, n_colors, n_runs, decision_model, decision_model_args,
     dm_args = decision_model_args,
     im_name = interference_model,
     im_args = interference_model_args,
+    engine = state_engine,
+    event_driven = event_driven,
+    jobs = jobs,
+    batch_size = batch_size,
+    output_format = output_format,
+    stream = stream,
+    profile = profile,
+    trace = trace,
     base_seed = base_seed,
     verbose = verbose)
   exp.run()
@@ -58,6 +83,28 @@ class Experiment:
 
   im_args (dict) : Additional arguments to provide Interference Model
 
+  engine (str) : State representation to simulate with
+
+  event_driven (bool) : Skip over ticks in which nothing spawns or expires
+
+  jobs (int) : Number of worker processes to spread runs across
+
+  batch_size (int) : Number of runs to simulate together in lockstep with a
+  BatchScenario. Batches are seeded from their first seed, so random decisions
+  differ from running the same seeds one at a time. Batches keep their own
+  state arrays, so engine and event_driven only apply with batch_size 1.
+
+  output_format (str) : 'csv' to write one .csv per run, or 'npz' to append
+  all runs to a RunStore in the experiment folder
+
+  profile (bool) : Time each phase of the runs, see aspr.sim.profiler
+
+  stream (bool) : Stream the rows of each run's .csv to disk in chunks as
+  the run produces them. Not supported with batch_size > 1 or npz output.
+
+  trace (bool) : Write the events of each run to a .trace.jsonl file with a
+  TraceSink. Not supported with batch_size > 1.
+
   out_f (str) : Folder to write output to
 
   base_seed (int) : Random seed to use
@@ -66,7 +113,15 @@ class Experiment:
   """
 
   def __init__(self, spt_f, nc, nr, dm_name, dm_args, im_name, im_args, 
-    base_seed, verbose):
+    base_seed, verbose, engine='object', event_driven=False, jobs=1,
+    batch_size=1, output_format='csv', stream=False, profile=False,
+    trace=False):
+    # arguments each worker process needs to build its own Experiment
+    self._worker_args = dict(spt_f=spt_f, nc=nc, nr=nr, dm_name=dm_name,
+      dm_args=dm_args, im_name=im_name, im_args=im_args, base_seed=base_seed,
+      verbose=verbose, engine=engine, event_driven=event_driven,
+      batch_size=batch_size, output_format=output_format, stream=stream,
+      profile=profile, trace=trace)
 
     self.nc = nc
     self.nr = nr
@@ -74,6 +129,14 @@ class Experiment:
     self.dm_args = dm_args
     self.im_name = im_name
     self.im_args = im_args
+    self.engine = engine
+    self.event_driven = event_driven
+    self.jobs = jobs
+    self.batch_size = batch_size
+    self.output_format = output_format
+    self.stream = stream
+    self.profile = profile
+    self.trace = trace
     self.base_seed = base_seed
     self.verbose = verbose
 
@@ -91,24 +154,167 @@ class Experiment:
     self.colors = list(range(self.nc))
 
     self.dm = DecisionModelFactory().\
-      get(self.dm_name, self.colors, self.dm_args, self.verbose)
+      get(self.dm_name, self.colors, self.dm_args, self.verbose, spt = self.spt)
     self.im = InterferenceModelFactory().\
       get(self.im_name, self.im_args)
+    weights = getattr(self.im, 'weights', None)
+    if weights is not None and len(weights) != self.nc:
+      raise ValueError(f'Interference weights are {weights.shape[0]}x'
+        f'{weights.shape[1]}, but there are {self.nc} colors')
+
+    self.store = RunStore(self.exp_f) if output_format == 'npz' else None
+    if trace and batch_size > 1:
+      self.logger.warning('Runs are not traced when batched (batch size > 1)')
+    if batch_size > 1 and (engine != 'object' or event_driven):
+      self.logger.warning('Batched runs (batch size > 1) simulate with their '
+        'own arrays, so --state-engine and --event-driven are ignored')
+    if stream and (batch_size > 1 or self.store):
+      self.logger.warning('Runs are only streamed with batch size 1 and csv output')
 
 
   def run(self):
     self.logger.info('..')
-    for i in range(self.base_seed + self.nr): self.run_seed(i)
+    seeds = list(range(self.base_seed + self.nr))
+    chunk_size = self.batch_size
+    if self.store and chunk_size == 1:
+      # one store chunk per task, but enough tasks to keep every worker busy
+      chunk_size = min(self.store.chunk_size, math.ceil(len(seeds) / self.jobs))
+    chunks = [seeds[i:i + chunk_size]
+      for i in range(0, len(seeds), chunk_size)]
+    prof = profiler.enable() if self.profile else None
+    try:
+      if self.jobs > 1:
+        stats = self.run_parallel(chunks, prof)
+      else:
+        done = 0
+        for chunk in chunks:
+          self.run_chunk(chunk)
+          done += len(chunk)
+          self.logger.info(f'Completed {done}/{len(seeds)} runs')
+        stats = self.dm.stats()
+      self.report(stats)
+      if prof: self.report_profile(prof)
+    finally:
+      if prof: profiler.disable()
+
+
+  def run_parallel(self, chunks, prof=None):
+    """Spread chunks of seeds across a pool of worker processes, each of
+    which builds its own decision and interference models. Worker profiles
+    are merged into prof."""
+    n_seeds = sum([len(chunk) for chunk in chunks])
+    self.logger.info(f'Running {n_seeds} seeds across {self.jobs} workers')
+    with ProcessPoolExecutor(max_workers = self.jobs, 
+      initializer = _init_worker, initargs = (self._worker_args,)) as pool:
+      futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+      done = 0
+      stats = Counter()
+      for future in as_completed(futures):
+        chunk, chunk_stats, chunk_profile = future.result()
+        stats.update(chunk_stats)
+        if prof: prof.merge(chunk_profile)
+        done += len(chunk)
+        self.logger.info(f'Completed {done}/{n_seeds} runs (seeds {chunk})')
+    return dict(stats)
+
+
+  def report(self, stats):
+    """Log the decision model's counters for the experiment"""
+    if not stats: return
+    self.logger.info(f'Decision model stats: {stats}')
+    if stats.get('decisions'):
+      self.logger.info('Mean time per decision: {:.3f}ms'.format(
+        1000 * stats['decide_time'] / stats['decisions']))
+    lookups = stats.get('cache_hits', 0) + stats.get('cache_misses', 0)
+    if lookups:
+      self.logger.info(
+        f'Look-ahead cache hit rate: {stats["cache_hits"] / lookups:.1%}')
+
+
+  def report_profile(self, prof):
+    """Log the time spent in each phase, and save it to profile.json"""
+    summary = prof.summary()
+    total = sum(p['seconds'] for p in summary['phases'].values())
+    for phase, p in summary['phases'].items():
+      self.logger.info(f'{phase:<10}: {p["seconds"]:.3f}s '
+        f'({p["seconds"] / total:.1%}) over {p["calls"]} calls')
+    self.logger.info(f'Counters: {summary["counters"]}')
+    path = prof.save(join(self.exp_f, PROFILE_FN))
+    self.logger.info(f'Saved profile to {path}')
+
+
+  def run_chunk(self, seeds):
+    if self.batch_size > 1:
+      self.run_batch(seeds)
+    else:
+      for seed in seeds: self.run_seed(seed)
+    if self.store:
+      prof = profiler.active
+      if prof: t0 = time.perf_counter()
+      self.store.flush()
+      if prof: prof.lap('write', t0)
+
+
+  def run_batch(self, seeds):
+    """Simulate the seeds together in lockstep"""
+    self.logger.debug('Running seeds: %s', seeds)
+    random.seed(seeds[0])
+    np.random.seed(seeds[0])
+    self.dm.reset()
+    batch = BatchScenario(len(seeds), self.nn, self.spt.copy(), self.colors,
+                          self.dm, self.im, self.name, verbose = self.verbose)
+    batch.run()
+    prof = profiler.active
+    for r, seed in enumerate(seeds):
+      if prof: t0 = time.perf_counter()
+      df = batch.to_df(r)
+      if prof: prof.lap('to_df', t0)
+      self.write(seed, df)
 
 
   def run_seed(self, seed):
-    self.logger.debug(f'Running seed: {seed}')
+    self.logger.debug('Running seed: %s', seed)
     random.seed(seed)
+    np.random.seed(seed)
+    self.dm.reset()
+    trace = TraceSink() if self.trace else None
+    sink = CsvSink(self.csv_path(seed), self.colors) \
+      if self.stream and not self.store else None
     scenario = Scenario(self.nn, self.spt.copy(), self.colors, self.dm, self.im, 
-                        f'{self.name}-{seed}', verbose = self.verbose)
+                        f'{self.name}-{seed}', verbose = self.verbose,
+                        engine = self.engine, event_driven = self.event_driven,
+                        trace = trace, sink = sink)
     scenario.run()
-    scenario.to_df().to_csv(
-      join(self.exp_f, f'{scenario.name}.csv'), index = False)
+    if trace: trace.save(join(self.exp_f, f'{self.name}-{seed}{TRACE_EXT}'))
+    prof = profiler.active
+    if sink:
+      # already written, as part of recording the history
+      if prof:
+        prof.count('bytes_written', os.path.getsize(sink.path))
+        prof.count('runs')
+      return
+    if prof: t0 = time.perf_counter()
+    df = scenario.to_df()
+    if prof: prof.lap('to_df', t0)
+    self.write(seed, df)
+
+
+  def write(self, seed, df):
+    prof = profiler.active
+    if prof: t0 = time.perf_counter()
+    if self.store:
+      self.store.append(seed, df.reset_index(drop = True))
+    else:
+      path = self.csv_path(seed)
+      df.to_csv(path, index = False)
+      if prof: prof.count('bytes_written', os.path.getsize(path))
+    if prof:
+      prof.lap('write', t0)
+      prof.count('runs')
+
+
+  def csv_path(self, seed):
+    return join(self.exp_f, f'{self.name}-{seed}.csv')
 
 
   def _setup_f(self, base, nc):
@@ -121,4 +327,19 @@ class Experiment:
   def exp_desc(self):
     return '-'.join([f'{self.dm_name}', f'{self.im_name}'])
 
-    
+
+_worker_exp = None
+
+def _init_worker(kwargs):
+  """Builds the Experiment used by a worker process"""
+  global _worker_exp
+  _worker_exp = Experiment(**kwargs)
+  if _worker_exp.profile: profiler.enable()
+
+
+def _run_chunk(seeds):
+  _worker_exp.dm.reset_stats()
+  prof = profiler.active
+  if prof: prof.reset()
+  _worker_exp.run_chunk(seeds)
+  return seeds, _worker_exp.dm.stats(), prof.summary() if prof else None
@@ -1,8 +1,22 @@
 import abc
 import numpy as np
+from aspr.sim.utils import parse_model_args
 
 class InterferenceModel(abc.ABC):
-  
+  """Computes the interference between pairs of active nodes.
+
+  Models whose score depends only on the colors of the nodes may also set
+  `aggregate = True` and implement score_counts(), which lets State score
+  from the number of active nodes per color instead of every pair.
+
+  State keeps a running score by adding and subtracting add_delta(). Models
+  whose deltas aren't exact in floating point (eg. fractional weights) set
+  `exact = False`, so State rescores from the counts after each change
+  rather than accumulating rounding error.
+  """
+  aggregate = False
+  exact = True
+
   def __init__(self):
     super().__init__()
 
@@ -10,19 +24,46 @@ class InterferenceModel(abc.ABC):
   def calc(self, u, v):
     pass
 
+  def score_counts(self, counts):
+    """Total interference given the number of active nodes of each color.
+    If counts has more than one dimension, scores along the last axis."""
+    raise NotImplementedError(f'{self.__class__.__name__} has no aggregate score')
+
+  def add_delta(self, counts, color):
+    """Change in score_counts() from activating one more node of `color`
+    when `counts` nodes are already active"""
+    after = list(counts)
+    after[color] += 1
+    return self.score_counts(after) - self.score_counts(counts)
+
+  def add_deltas(self, counts):
+    """add_delta() for every color at once, along the last axis of counts"""
+    counts = np.asarray(counts)
+    deltas = np.empty(counts.shape, dtype=float)
+    for idx in np.ndindex(counts.shape[:-1]):
+      deltas[idx] = [self.add_delta(counts[idx], c) for c in range(counts.shape[-1])]
+    return deltas
+
 
 class InterferenceModelFactory:
 
   @staticmethod
-  def options(): return ['binary']
+  def options(): return ['binary', 'matrix']
 
   def get(self, name, *args):
     if name == 'binary':
       return BinaryInterference()
+    if name == 'matrix':
+      args = parse_model_args(args[0] if args else None, 'weights')
+      if 'weights' not in args:
+        raise ValueError('matrix interference needs a weight file, eg. '
+          '--interference-model-args weights.txt')
+      return MatrixInterference.from_file(args['weights'])
 
 
 
 class BinaryInterference(InterferenceModel):
+  aggregate = True
 
   def calc(self, u, v):
     if u.id != v.id and u.color >= 0 and u.color == v.color:
@@ -30,3 +71,79 @@ class BinaryInterference(InterferenceModel):
     else:
       return 0
 
+  def score_counts(self, counts):
+    """Each pair of active nodes sharing a color scores 1, so the total is
+    the sum over colors of C(n, 2)"""
+    counts = np.asarray(counts)
+    score = np.sum(counts * (counts - 1), axis=-1) / 2
+    return score if score.ndim else float(score)
+
+  def add_delta(self, counts, color):
+    """A new node pairs with every active node of the same color"""
+    return float(counts[color])
+
+  def add_deltas(self, counts):
+    return np.asarray(counts, dtype=float)
+
+
+class MatrixInterference(InterferenceModel):
+  """Interference given by a k x k matrix of weights between colors, such
+  that w(u, v) = W[c(u), c(v)], eg. to give adjacent colors (channels) some
+  leakage. Pairs of nodes are counted once, and an asymmetric W scores the
+  mean of W[c(u), c(v)] and W[c(v), c(u)].
+
+  Parameters
+  ----------
+
+  weights (array) : k x k matrix of non-negative weights, indexed by color
+  """
+  aggregate = True
+
+  def __init__(self, weights):
+    super().__init__()
+    self.weights = np.asarray(weights, dtype=float)
+    if self.weights.ndim != 2 or self.weights.shape[0] != self.weights.shape[1]:
+      raise ValueError(f'Weights must be a square matrix, got shape {self.weights.shape}')
+    if np.any(self.weights < 0):
+      # BeamDecision prunes on the cost of a partial coloring never falling
+      raise ValueError('Weights must not be negative')
+    self._diag = np.diag(self.weights).copy()
+    self._sym = self.weights + self.weights.T
+    self.exact = bool(np.all(self.weights == np.round(self.weights)))
+
+  @classmethod
+  def from_file(cls, path):
+    """Reads weights from a .npy file, or a text file with a row of weights
+    per color separated by whitespace or commas"""
+    if path.endswith('.npy'):
+      return cls(np.load(path))
+    with open(path, 'r') as f:
+      rows = [line.replace(',', ' ').split() for line in f]
+    return cls([[float(w) for w in row] for row in rows if row])
+
+  def calc(self, u, v):
+    if u.id != v.id and u.color >= 0 and v.color >= 0:
+      return self.weights[u.color, v.color]
+    else:
+      return 0
+
+  def score_counts(self, counts):
+    """Sum of W over pairs of active nodes, as the quadratic form
+    0.5 * (nᵀWn - Σ n_c W_cc) of the per-color counts n, where the second
+    term removes each node's pairing with itself.
+
+    The terms are summed elementwise rather than with a matrix product, so
+    a row of stacked counts scores exactly the same as the row on its own
+    (batched runs must match serial ones)."""
+    counts = np.asarray(counts, dtype=float)
+    pairs = counts[..., :, None] * self.weights * counts[..., None, :]
+    score = (pairs.sum(axis=(-2, -1)) - (counts * self._diag).sum(axis=-1)) / 2
+    return score if score.ndim else float(score)
+
+  def add_delta(self, counts, color):
+    """A new node pairs with every active node d, for (W[c, d] + W[d, c]) / 2"""
+    return float(np.dot(counts, self._sym[color])) / 2
+
+  def add_deltas(self, counts):
+    counts = np.asarray(counts, dtype=float)
+    return (counts[..., :, None] * self._sym).sum(axis=-2) / 2
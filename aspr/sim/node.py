@@ -3,12 +3,22 @@ from aspr.constants import NODE_TTL
 class Node:
   """
   """
+  __slots__ = ('id', 'color', 'ttl')
+
   def __init__(self, id):
     self.id = id
     self.color = -1
     self.ttl = NODE_TTL
 
 
+  def copy(self):
+    node = Node.__new__(Node)
+    node.id = self.id
+    node.color = self.color
+    node.ttl = self.ttl
+    return node
+
+
   def tick(self):
     if self.ttl <= 0 and self.color != -1:
       self.color = -1
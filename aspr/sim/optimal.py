@@ -0,0 +1,212 @@
+"""Offline solver for the minimum total interference of a spawn schedule"""
+
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.utils import _setup_logger
+from aspr.constants import OUTPUTS, NODE_TTL, OPTIMAL_FN
+import numpy as np
+import os, json, click
+from os.path import join, exists
+
+@click.command()
+@click.option('-s', '--spawn-times', required=True, help='Folder containing spawn times. Generate this using `aspr_spt`.')
+@click.option('-c', '--n-colors', default=4, help='Number of node colors available.')
+@click.option('-ms', '--max-states', default=100000, help='Number of partial colorings to keep per spawn. 0 for no limit.')
+@click.option('-v', '--verbose', count=True, help='Log level. Options: -v -vv')
+def cli(spawn_times, n_colors, max_states, verbose):
+  """Computes the minimum total (binary) interference for a set of spawn
+  times, and writes it next to the experiment outputs"""
+  spt_path = join(OUTPUTS, spawn_times)
+  spt = SpawnTimeUtil().read(spt_path)
+  solver = OptimalSolver(spt, list(range(n_colors)), max_states or None, verbose)
+  result = solver.solve()
+  path = solver.save(result, join(spt_path, f'nc{n_colors}'))
+  status = 'optimal' if result['optimal'] else f'lower bound {result["lower_bound"]}'
+  click.echo(f'Score: {result["score"]} ({status}). Saved to {path}')
+  return 0
+
+
+class OptimalSolver:
+  """Finds the coloring of a spawn schedule with the least total binary
+  interference.
+
+  A node spawned at s is active for ticks s..s+NODE_TTL, so two nodes
+  spawned at s_i and s_j are active together for
+  max(0, NODE_TTL + 1 - |s_i - s_j|) ticks, and the total interference of a
+  coloring is the sum of this over pairs with the same color.
+
+  Spawns are colored in order with a DP over the frontier of nodes which
+  can still overlap a later spawn. Only which frontier nodes share a color
+  matters, so colors are relabelled by first appearance and partial
+  colorings with the same frontier partition are merged (symmetry
+  breaking). Partial colorings which can't beat a greedy coloring are
+  pruned, using a lower bound on the interference among the remaining
+  spawns: at every tick, the active nodes split as evenly as possible
+  across the colors. When the greedy coloring meets this bound it is
+  optimal and no search is needed, which is common for schedules from
+  aspr_spt.
+
+  Parameters
+  ----------
+
+  spt (list) : Spawn times
+
+  colors (list) : Available colors
+
+  max_states (int) : If given, only the cheapest max_states partial colorings
+  are kept per spawn. The result is then an upper bound, along with a lower
+  bound on the optimum.
+
+  verbose (int) : Log verbosity. Options: {0: lowest, 1: info, 2: debug}
+  """
+  WIDTH = 10
+
+  def __init__(self, spt, colors, max_states=None, verbose=0):
+    self.spt = sorted(spt)
+    self.colors = colors
+    self.max_states = max_states
+    self.name = 'OptimalSolver'
+    self.logger = _setup_logger(self, verbose = verbose)
+    self.logger.debug(f'<init>: n={len(self.spt)}, colors={colors}')
+
+
+  def pair_weight(self, i, j):
+    """Number of ticks in which spawns i and j are both active"""
+    return max(0, NODE_TTL + 1 - abs(self.spt[i] - self.spt[j]))
+
+
+  def score(self, colors):
+    """Total interference of a coloring of every spawn"""
+    return sum(self.pair_weight(i, j)
+      for j in range(len(colors)) for i in range(j) if colors[i] == colors[j])
+
+
+  def remaining_bounds(self):
+    """bounds[j] is a lower bound on the interference among spawns j.. under
+    any coloring"""
+    n, k = len(self.spt), len(self.colors)
+    bounds = np.zeros(n + 1, dtype=int)
+    if not n: return bounds
+    spt = np.asarray(self.spt) - self.spt[0]
+    active = np.zeros((n, spt[-1] + NODE_TTL + 1), dtype=int)
+    for i, s in enumerate(spt): active[i, s:s + NODE_TTL + 1] = 1
+    counts = np.cumsum(active[::-1], axis=0)[::-1]
+    q, r = np.divmod(counts, k)
+    balanced = r * (q + 1) * q // 2 + (k - r) * q * (q - 1) // 2
+    bounds[:n] = balanced.sum(axis=1)
+    return bounds
+
+
+  def greedy(self):
+    """Colors each spawn with the color adding the least interference"""
+    colors = []
+    for j in range(len(self.spt)):
+      added = [sum(self.pair_weight(i, j) for i in range(j) if colors[i] == c)
+        for c in self.colors]
+      colors.append(self.colors[int(np.argmin(added))])
+    return self.score(colors), colors
+
+
+  @staticmethod
+  def canonical(labels):
+    """Relabel by order of first appearance"""
+    relabel = {}
+    return tuple(relabel.setdefault(l, len(relabel)) for l in labels)
+
+
+  def solve(self):
+    """Returns a dict with the best coloring found, its score, a lower bound
+    on the optimum and whether the coloring is optimal.
+
+    Searches keeping 10, 100, .. partial colorings per spawn, up to
+    max_states, using the best coloring so far to prune the next search.
+    A narrow search usually finds the optimum, so the wider ones mostly
+    prove it."""
+    bounds = self.remaining_bounds()
+    score, colors = self.greedy()
+    labels = [self.colors.index(c) for c in colors]
+    self.logger.info(f'Greedy score: {score}')
+
+    width, lower_bound = self.WIDTH, bounds[0]
+    n_pruned, max_layer = 0, 1
+    while lower_bound < score:
+      if self.max_states and width >= self.max_states: width = self.max_states
+      unbounded = not self.max_states and width >= self.WIDTH ** 5
+      search = self.search(None if unbounded else width, score, labels, bounds)
+      score, labels, dropped, pruned, layer = search
+      n_pruned += pruned
+      max_layer = max(max_layer, layer)
+      lower_bound = max(lower_bound, min(score, dropped))
+      self.logger.info(f'Width {width}: score {score}, lower bound {lower_bound}')
+      if width == self.max_states or unbounded: break
+      width *= self.WIDTH
+
+    return {
+      'score': int(score),
+      'lower_bound': int(lower_bound),
+      'optimal': bool(lower_bound == score),
+      'n_colors': len(self.colors),
+      'spt': [int(s) for s in self.spt],
+      'colors': [self.colors[l] for l in labels],
+      'max_states': max_layer,
+      'pruned': n_pruned}
+
+
+  def search(self, width, best_score, best_labels, bounds):
+    """DP over spawns keeping the `width` cheapest partial colorings per
+    spawn (all of them if width is None), pruning any which can't beat
+    best_score. Returns (score, labels, dropped, pruned, max_layer), where
+    dropped is a lower bound on the colorings cut by the width."""
+    n, k = len(self.spt), len(self.colors)
+
+    # layer: frontier partition -> (cost, parent partition, label, labels)
+    layer = {(): (0, None, None, ())}
+    layers = []
+    frontier = []
+    dropped = np.inf
+    n_pruned, max_layer = 0, 1
+    for j in range(n):
+      keep = [p for p, i in enumerate(frontier)
+        if self.pair_weight(i, j) > 0]
+      weights = [self.pair_weight(frontier[p], j) for p in keep]
+      children = {}
+      for key, (cost, _, _, labels) in layer.items():
+        kept = [labels[p] for p in keep]
+        used = sorted(set(kept))
+        options = used + [min(set(range(k)) - set(used))] if len(used) < k else used
+        for c in options:
+          total = cost + sum(w for w, l in zip(weights, kept) if l == c)
+          if total + bounds[j + 1] >= best_score:
+            n_pruned += 1
+            continue
+          child = tuple(kept) + (c,)
+          child_key = self.canonical(child)
+          if child_key not in children or total < children[child_key][0]:
+            children[child_key] = (total, key, c, child)
+
+      if width and len(children) > width:
+        ranked = sorted(children.items(), key=lambda item: item[1][0])
+        dropped = min(dropped, ranked[width][1][0] + bounds[j + 1])
+        children = dict(ranked[:width])
+
+      max_layer = max(max_layer, len(children))
+      self.logger.debug(f'Spawn {j}: {len(children)} partial colorings')
+      layers.append(children)
+      layer = children
+      frontier = [frontier[p] for p in keep] + [j]
+      if not layer: break
+
+    if layer:
+      key = min(layer, key=lambda key: layer[key][0])
+      best_score, best_labels = layer[key][0], []
+      for children in layers[::-1]:
+        _, key, c, _ = children[key]
+        best_labels.append(c)
+      best_labels = best_labels[::-1]
+    return best_score, best_labels, dropped, n_pruned, max_layer
+
+
+  def save(self, result, folder):
+    if not exists(folder): os.makedirs(folder)
+    path = join(folder, OPTIMAL_FN)
+    with open(path, 'w') as f: json.dump(result, f, indent=1)
+    return path
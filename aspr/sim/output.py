@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import os, glob
+from os.path import join, exists
+from aspr.sim import profiler
+from aspr.sim.state import records_to_df
+
+RUN_COL = 'run'
+
+
+class RunStore:
+  """Columnar store for the runs of an experiment, as an alternative to
+  writing one .csv per run.
+
+  Runs are buffered and written in chunks of compressed .npz files, one
+  array per column, with integer columns narrowed to the smallest dtype that
+  holds their values. Every row has a `run` column identifying the run it
+  belongs to. Chunks are named after their first run id, so separate
+  processes can write into the same folder.
+
+  Parameters
+  ----------
+
+  folder (str) : Folder to write chunks to / read chunks from
+
+  prefix (str) : Filename prefix of the chunks, so several stores (eg. runs
+  and features) can share a folder
+
+  chunk_size (int) : Number of runs to buffer before writing a chunk
+  """
+  EXT = '.npz'
+
+  def __init__(self, folder, prefix='runs', chunk_size=100):
+    self.folder = folder
+    self.prefix = prefix
+    self.chunk_size = chunk_size
+    self._buffer = []
+
+
+  @staticmethod
+  def exists(folder, prefix='runs'):
+    return len(RunStore(folder, prefix).chunks()) > 0
+
+
+  def chunks(self):
+    return sorted(glob.glob(join(self.folder, f'{self.prefix}-*{self.EXT}')))
+
+
+  def append(self, run_id, df):
+    """Buffer a run, writing a chunk once chunk_size runs are buffered. If
+    chunk_size is None, chunks are only written by .flush()"""
+    self._buffer.append((run_id, df))
+    if self.chunk_size and len(self._buffer) >= self.chunk_size: self.flush()
+
+
+  def flush(self):
+    """Write the buffered runs as one chunk"""
+    if not self._buffer: return
+    if not exists(self.folder): os.makedirs(self.folder)
+    columns = list(self._buffer[0][1].columns)
+    arrays = {RUN_COL: np.concatenate(
+      [np.full(len(df.index), run_id) for run_id, df in self._buffer])}
+    for col in columns:
+      arrays[col] = np.concatenate(
+        [df[col].to_numpy() for _, df in self._buffer])
+    arrays = {col: _compact(arr) for col, arr in arrays.items()}
+
+    first_run = self._buffer[0][0]
+    path = join(self.folder, f'{self.prefix}-{first_run:06d}{self.EXT}')
+    np.savez_compressed(path, __columns__=np.array([RUN_COL] + columns),
+      **arrays)
+    if profiler.active: profiler.active.count('bytes_written', os.path.getsize(path))
+    self._buffer = []
+    return path
+
+
+  def read_chunk(self, path):
+    with np.load(path) as data:
+      columns = list(data['__columns__'])
+      return pd.DataFrame({col: data[col] for col in columns})
+
+
+  def read_df(self):
+    """All rows of the store as a single DataFrame"""
+    dfs = [self.read_chunk(path) for path in self.chunks()]
+    return pd.concat(dfs, ignore_index=True)
+
+
+  def read(self):
+    """Yields (run_id, df) for each run in the store, with the run column
+    dropped so df has the same columns as the run's .csv"""
+    for path in self.chunks():
+      yield from self.read_chunk_runs(path)
+
+
+  def read_chunk_runs(self, path):
+    """Yields (run_id, df) for each run in one chunk"""
+    df = self.read_chunk(path)
+    runs = df[RUN_COL].to_numpy()
+    bounds = np.flatnonzero(np.diff(runs)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(runs)]):
+      run_df = df.iloc[start:end].drop(columns=RUN_COL)
+      yield int(runs[start]), run_df.reset_index(drop=True)
+
+
+class CsvSink:
+  """Streams the rows of a History to a .csv in chunks, as the scenario
+  produces them, so memory doesn't grow with the length of the scenario.
+  The file is the same as writing the History's .to_df() at the end.
+
+  Parameters
+  ----------
+
+  path (str) : .csv file to write
+
+  colors (list) : Colors of the scenario, for the column names
+
+  chunk_size (int) : Number of rows the History buffers between writes
+  """
+  def __init__(self, path, colors, chunk_size=1000):
+    self.path = path
+    self.colors = colors
+    self.chunk_size = chunk_size
+    self._started = False
+
+
+  def write(self, t, actvn_cnt, node_colors, node_ttls, score, n_active,
+    ttl_total):
+    """Append a chunk of rows, given as per-tick columns"""
+    df = records_to_df(self.colors, t, node_colors, node_ttls, score,
+      n_active, ttl_total)
+    df.to_csv(self.path, mode='a' if self._started else 'w',
+      header=not self._started, index=False)
+    self._started = True
+
+
+def file_signature(path):
+  """(mtime, size) of a file, to tell whether it changed since it was read"""
+  stat = os.stat(path)
+  return [stat.st_mtime_ns, stat.st_size]
+
+
+def _compact(arr):
+  """Narrow an integer array to the smallest dtype which holds its values"""
+  if not np.issubdtype(arr.dtype, np.integer) or not len(arr):
+    return arr
+  lo, hi = arr.min(), arr.max()
+  for dtype in [np.int8, np.int16, np.int32, np.int64]:
+    info = np.iinfo(dtype)
+    if info.min <= lo and hi <= info.max:
+      return arr.astype(dtype)
+  return arr
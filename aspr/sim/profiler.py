@@ -0,0 +1,78 @@
+"""Timers and counters for the phases of a run, enabled with --profile"""
+
+import json, time
+from collections import Counter
+
+# The Profiler which hooks report to, or None if profiling is disabled. Hooks
+# check this before doing anything else, so they cost a single check when
+# disabled.
+active = None
+
+
+def enable():
+  """Start reporting hooks to a new Profiler, and return it"""
+  global active
+  active = Profiler()
+  return active
+
+
+def disable():
+  """Stop profiling, and return the Profiler which was active"""
+  global active
+  prof, active = active, None
+  return prof
+
+
+class Profiler:
+  """Accumulates the time spent in and number of calls of each phase of a
+  run (eg. tick, decide, record, write), along with counters of events (eg.
+  ticks simulated, states copied, bytes written).
+
+  Phases are timed with lap():
+
+    t0 = time.perf_counter()
+    state.tick()
+    t0 = prof.lap('tick', t0)
+  """
+  def __init__(self):
+    self.seconds = Counter()
+    self.calls = Counter()
+    self.counters = Counter()
+
+
+  def lap(self, phase, start):
+    """Add the time since `start` to phase. Returns the current time, to
+    start timing the next phase from."""
+    now = time.perf_counter()
+    self.seconds[phase] += now - start
+    self.calls[phase] += 1
+    return now
+
+
+  def count(self, name, n=1):
+    self.counters[name] += n
+
+
+  def reset(self):
+    self.seconds.clear()
+    self.calls.clear()
+    self.counters.clear()
+
+
+  def summary(self):
+    phases = {phase: {'seconds': self.seconds[phase], 'calls': self.calls[phase]}
+      for phase in sorted(self.seconds, key=self.seconds.get, reverse=True)}
+    return {'phases': phases, 'counters': dict(sorted(self.counters.items()))}
+
+
+  def merge(self, summary):
+    """Add the summary() of another Profiler, eg. from a worker process"""
+    for phase, p in summary['phases'].items():
+      self.seconds[phase] += p['seconds']
+      self.calls[phase] += p['calls']
+    self.counters.update(summary['counters'])
+
+
+  def save(self, path):
+    with open(path, 'w') as f: json.dump(self.summary(), f, indent=1)
+    return path
@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
-import copy
-from aspr.sim.state import State, History
+import copy, time, logging
+from aspr.sim.state import State, StateFactory, History
 from aspr.sim.utils import _setup_logger
+from aspr.sim import profiler
 
 class Scenario:
   """This class encapsulates a single simulation from beginning to end.
@@ -36,48 +37,123 @@ class Scenario:
 
   name : str
     The name for the logger to use.
+
+  engine : str
+    The state representation to simulate with. See StateFactory.options()
+
+  event_driven : bool
+    If set, jump over ticks in which no node spawns or expires, recording
+    them in bulk. Produces the same history as ticking one unit at a time.
+
+  trace : TraceSink
+    If given, each tick, skip and spawn is emitted to it as an event.
+
+  sink : CsvSink
+    If given, the history is streamed to it in chunks as the scenario runs,
+    rather than kept in memory. .to_df() is then unavailable.
   """
   def __init__(self, n_nodes, spt, colors, dec_model, int_model, name,
-    verbose=0):
-    self.state = State().init(n_nodes, int_model, colors, verbose = verbose)
-    self.history = History(self.state)
+    verbose=0, engine='object', event_driven=False, trace=None, sink=None):
+    self.state = StateFactory().get(engine).init(
+      n_nodes, int_model, colors, verbose = verbose)
+    if sink is None:
+      self.history = History(self.state)
+    else:
+      self.history = History(self.state, capacity=sink.chunk_size, sink=sink)
     self.spt = spt
     self.colors = colors
     self.dec_model = dec_model
+    self.event_driven = event_driven
+    self.trace = trace
     self.name = name
     self.logger = _setup_logger(self, verbose=verbose)
+    # checked once, so debug messages aren't formatted when they're disabled
+    self._debug = self.logger.isEnabledFor(logging.DEBUG)
     self.logger.debug('<init>')
 
 
   def run(self):
     self.logger.info('Starting...')
-    self.logger.debug(f'Spawn times: {self.spt}')
+    if self._debug: self.logger.debug('Spawn times: %s', self.spt)
     next_spawn = self.spt.pop(0)
+    prof = profiler.active
+    trace = self.trace
 
     while True:
+      # skip over ticks in which nothing spawns or expires
+      if self.event_driven:
+        if prof: t0 = time.perf_counter()
+        n_quiet = self.quiet_ticks(next_spawn)
+        if n_quiet > 0:
+          if trace: trace.emit('skip', t=self.state.t, n=n_quiet)
+          self.state.advance(n_quiet)
+          if prof:
+            t0 = prof.lap('advance', t0)
+            prof.count('ticks', n_quiet)
+          self.history.record_span(self.state, n_quiet)
+          if prof: prof.lap('record', t0)
+          m = self.check_end()
+          if m: return self.end_run(m)
+
       # all nodes update their state
-      self.logger.debug(f'Tick: t={self.state.t}')
+      if prof: t0 = time.perf_counter()
       self.state.tick()
+      if prof:
+        t0 = prof.lap('tick', t0)
+        prof.count('ticks')
+      if trace: trace.emit('tick', t=self.state.t, score=self.state.score())
 
       # check for new node activations
       if self.state.t == next_spawn:
-        self.logger.debug(f'Spawn at t={self.state.t}')
         decision = self.dec_model.decide(self.history)
+        if prof:
+          t0 = prof.lap('decide', t0)
+          prof.count('decisions')
+        if trace: trace.emit('spawn', t=self.state.t,
+          node=self.state.actvn_cnt, color=int(decision))
+        if self._debug:
+          self.logger.debug('Spawn at t=%d: c=%s, %d spawns remaining',
+            self.state.t, decision, len(self.spt))
         self.state.activate(decision)
+        if prof: t0 = prof.lap('activate', t0)
         if self.spt:
-          self.logger.debug(f'Remaining spt: {self.spt}')
           next_spawn = self.spt.pop(0)
 
       # record state
       self.history.record(self.state)
+      if prof: prof.lap('record', t0)
+
+      m = self.check_end()
+      if m: return self.end_run(m)
+
+
+  def check_end(self):
+    """Returns the reason the run should end, or None"""
+    # exit if all time-to-live expired
+    if self.state.all_nodes_expired():
+      return 'All nodes TTL expired.'
+
+    # exit if no more spawns, and all activated nodes ttl expired
+    if self.all_spawns_complete(self.spt, self.state):
+      return 'All spawns complete.'
+
 
-      # exit if all time-to-live expired
-      if self.state.all_nodes_expired():
-        return self.end_run('All nodes TTL expired.')
+  def quiet_ticks(self, next_spawn):
+    """The number of ticks from now in which no node spawns or expires. A
+    node with ttl x expires on the (x+1)th tick."""
+    bounds = []
+    if next_spawn > self.state.t:
+      bounds.append(next_spawn - self.state.t - 1)
+    min_ttl = self.state.min_active_ttl()
+    if min_ttl is not None:
+      bounds.append(min_ttl)
+    if not bounds:
+      return 0
 
-      # exit if no more spawns, and all activated nodes ttl expired
-      if self.all_spawns_complete(self.spt, self.state):
-        return self.end_run('All spawns complete.')
+    # an ending condition that already holds ends the run after one tick
+    if self.check_end():
+      return min(min(bounds), 1)
+    return min(bounds)
 
 
   def all_spawns_complete(self, spt, state):
@@ -90,6 +166,7 @@ class Scenario:
     # perform one last tick and record
     self.state.tick()
     self.history.record(self.state)
+    if self.history.sink is not None: self.history.flush()
     self.logger.info('Simulation complete: %s' % m)
 
 
@@ -98,10 +175,7 @@ class Scenario:
 
 
   def to_df(self):
-    d = [state.to_dict() for state in self.history.read()]
-    df = pd.DataFrame(d)
-    df.set_index('t', inplace=True)
-    return df
+    return self.history.to_df()
 
 
 
@@ -1,14 +1,20 @@
 import pandas as pd
 import numpy as np
-import copy
+import collections, logging
 from aspr.sim.utils import _setup_logger
 from aspr.sim.node import Node
+from aspr.sim import profiler
+from aspr.constants import NODE_TTL
 
 class State:
   """Encapsulates the state of a scenario at a given point in time.
 
   Note: use .init() to initialise with values.
 
+  Copies share the interference model and colors of the state they were
+  copied from, and only copy the node and per-color data which ticking and
+  activation change. Neither is mutated by a State.
+
   Parameters
   ----------
 
@@ -24,6 +30,11 @@ class State:
   @property
   def name(self): return self.__class__.__name__
 
+  @property
+  def logger(self):
+    """States share the logger of their class, so copies don't carry one"""
+    return logging.getLogger(self.name)
+
   def init(self, size, int_model, colors, verbose=0):
     """Non-ctor method to init so blank instances can be created for .copy()"""
     self.t = 0
@@ -33,30 +44,49 @@ class State:
     self.nodes = []
     for i in range(size):
       self.nodes.append(Node(i))
-    self.logger = _setup_logger(self, verbose=verbose)
+    self.n_active = [0] * len(colors)
+    self.ttl_total = [0] * len(colors)
+    self._score = 0.0
+    _setup_logger(self, verbose=verbose)
     return self
 
 
   def _copy(self, target):
-    #TODO: is there a better way of doing this?
     self.t = target.t
-    self.int_model = copy.deepcopy(target.int_model)
-    self.actvn_cnt = copy.deepcopy(target.actvn_cnt)
-    self.nodes  = copy.deepcopy(target.nodes)
-    self.colors = copy.deepcopy(target.colors)
-    self.logger = target.logger
+    self.int_model = target.int_model
+    self.actvn_cnt = target.actvn_cnt
+    self.nodes = [n.copy() for n in target.nodes]
+    self.colors = target.colors
+    self.n_active = list(target.n_active)
+    self.ttl_total = list(target.ttl_total)
+    self._score = target._score
     return self
 
 
   def copy(self):
-    return State()._copy(self)
+    if profiler.active: profiler.active.count('states_copied')
+    return self.__class__()._copy(self)
 
 
   def tick(self):
-    self.logger.debug('tick: ..')
     self.t += 1
     for n in self.nodes:
+      color = n.color
       n.tick()
+      if color != n.color: self._deactivate(color)
+    for c, n_active in enumerate(self.n_active):
+      self.ttl_total[c] -= n_active
+    return self
+
+
+  def advance(self, n):
+    """Perform n ticks in bulk. Only valid if no node expires during them,
+    ie. every active node has a ttl of at least n."""
+    self.t += n
+    for node in self.nodes:
+      if node.color >= 0: node.ttl -= n
+    for c, n_active in enumerate(self.n_active):
+      self.ttl_total[c] -= n * n_active
     return self
 
 
@@ -70,16 +100,70 @@ class State:
     if self.actvn_cnt >= len(self.nodes):
       self.logger.debug('All nodes already activated. Continuing.')
       return
-    self.logger.debug(f'Activating: n{self.actvn_cnt} <- c{color}')
-    self.nodes[self.actvn_cnt].color = color
+    node = self.nodes[self.actvn_cnt]
+    node.color = color
+    self._activate(color, node.ttl)
     self.actvn_cnt += 1
     return self
 
 
+  def _activate(self, color, ttl):
+    """Update the running per-color statistics for a node activation"""
+    im = self.int_model
+    if im.aggregate and im.exact:
+      self._score += im.add_delta(self.n_active, color)
+    self.n_active[color] += 1
+    self.ttl_total[color] += ttl
+    if im.aggregate and not im.exact:
+      self._score = im.score_counts(self.n_active)
+
+
+  def _deactivate(self, color):
+    """Update the running per-color statistics for a node expiring. Expiring
+    nodes have no ttl left, so the ttl total is unchanged."""
+    im = self.int_model
+    self.n_active[color] -= 1
+    if im.aggregate and im.exact:
+      self._score -= im.add_delta(self.n_active, color)
+    elif im.aggregate:
+      self._score = im.score_counts(self.n_active)
+
+
+  def node_arrays(self):
+    """Node colors and TTLs as arrays"""
+    node_colors = np.array([n.color for n in self.nodes], dtype=int)
+    node_ttls = np.array([n.ttl for n in self.nodes], dtype=int)
+    return node_colors, node_ttls
+
+
+  def load(self, t, actvn_cnt, node_colors, node_ttls):
+    """Overwrite this state's nodes with the given colors and TTLs"""
+    self.t = t
+    self.actvn_cnt = actvn_cnt
+    for n, color, ttl in zip(self.nodes, node_colors, node_ttls):
+      n.color = int(color)
+      n.ttl = int(ttl)
+    return self._recount()
+
+
+  def _recount(self):
+    """Rebuild the running per-color statistics from the nodes"""
+    self.n_active = [0] * len(self.colors)
+    self.ttl_total = [0] * len(self.colors)
+    self._score = 0.0
+    for n in self.nodes:
+      if n.color != -1: self._activate(n.color, n.ttl)
+    return self
+
+
   def score(self):
+    if profiler.active: profiler.active.count('scores')
+    if self.int_model.aggregate:
+      return self._score
     sum = 0
-    for u in self.nodes:
-      for v in self.nodes:
+    nodes = self.nodes # an ArrayState builds its nodes on each access
+    for u in nodes:
+      for v in nodes:
         if u.id != v.id:
           sum += self.int_model.calc(u, v)
     return sum/2
@@ -95,14 +179,183 @@ class State:
     return d
 
 
+  def active_counts(self):
+    """Number of active nodes of each color"""
+    counts = [0] * len(self.colors)
+    for n in self.nodes:
+      if n.color != -1: counts[n.color] += 1
+    return counts
+
+
   def count_active_nodes(self):
     return [n.color != -1 for n in self.nodes].count(True)
 
 
+  def min_active_ttl(self):
+    """Smallest ttl of any active node, or None if none are active"""
+    ttls = [n.ttl for n in self.nodes if n.color != -1]
+    return min(ttls) if ttls else None
+
+
   def all_nodes_expired(self):
     return all([n.ttl <= 0 for n in self.nodes])
 
 
+class ArrayState(State):
+  """Drop-in replacement for State which stores node colors and TTLs in
+  NumPy arrays, so that ticking and activation are vectorized rather than
+  looping over Node objects.
+
+  Note: use .init() to initialise with values.
+
+  Parameters
+  ----------
+
+  size (int) : the number of nodes
+
+  int_model (InterferenceModel) : the model to use to calculate intereference
+  between nodes
+
+  colors (list(int)) : the available colors for node activation
+
+  verbose (int) : Log level.
+  """
+  def init(self, size, int_model, colors, verbose=0):
+    """Non-ctor method to init so blank instances can be created for .copy()"""
+    self.t = 0
+    self.int_model = int_model
+    self.colors = colors
+    self.actvn_cnt = 0
+    self.node_colors = np.full(size, -1, dtype=int)
+    self.node_ttls = np.full(size, NODE_TTL, dtype=int)
+    self.n_active = np.zeros(len(colors), dtype=int)
+    self.ttl_total = np.zeros(len(colors), dtype=int)
+    self._score = 0.0
+    _setup_logger(self, verbose=verbose)
+    return self
+
+
+  def _copy(self, target):
+    self.t = target.t
+    self.int_model = target.int_model
+    self.actvn_cnt = target.actvn_cnt
+    self.node_colors = target.node_colors.copy()
+    self.node_ttls = target.node_ttls.copy()
+    self.colors = target.colors
+    self.n_active = target.n_active.copy()
+    self.ttl_total = target.ttl_total.copy()
+    self._score = target._score
+    return self
+
+
+  @property
+  def nodes(self):
+    """Node objects materialised from the arrays, for compatibility with
+    code that inspects individual nodes (eg. InterferenceModel.calc)"""
+    nodes = []
+    for i, (color, ttl) in enumerate(zip(self.node_colors, self.node_ttls)):
+      n = Node(i)
+      n.color = int(color)
+      n.ttl = int(ttl)
+      nodes.append(n)
+    return nodes
+
+
+  def tick(self):
+    self.t += 1
+    active = self.node_colors != -1
+    expire = active & (self.node_ttls <= 0)
+    if expire.any():
+      for color in self.node_colors[expire]: self._deactivate(color)
+      self.node_colors[expire] = -1
+    self.node_ttls[active & ~expire] -= 1
+    self.ttl_total -= self.n_active
+    return self
+
+
+  def advance(self, n):
+    self.t += n
+    self.node_ttls[self.node_colors != -1] -= n
+    self.ttl_total -= n * self.n_active
+    return self
+
+
+  def activate(self, color):
+    if self.actvn_cnt >= len(self.node_colors):
+      self.logger.debug('All nodes already activated. Continuing.')
+      return
+    self.node_colors[self.actvn_cnt] = color
+    self._activate(color, self.node_ttls[self.actvn_cnt])
+    self.actvn_cnt += 1
+    return self
+
+
+  def node_arrays(self):
+    return self.node_colors, self.node_ttls
+
+
+  def load(self, t, actvn_cnt, node_colors, node_ttls):
+    self.t = t
+    self.actvn_cnt = actvn_cnt
+    self.node_colors[:] = node_colors
+    self.node_ttls[:] = node_ttls
+    return self._recount()
+
+
+  def _recount(self):
+    active = self.node_colors != -1
+    k = len(self.colors)
+    self.n_active = np.bincount(self.node_colors[active], minlength=k)
+    self.ttl_total = np.bincount(self.node_colors[active],
+      weights=self.node_ttls[active], minlength=k).astype(int)
+    self._score = self.int_model.score_counts(self.n_active) \
+      if self.int_model.aggregate else 0.0
+    return self
+
+
+  def to_dict(self):
+    d = {'t': self.t}
+    for i, (color, ttl) in enumerate(zip(self.node_colors, self.node_ttls)):
+      d[f'n{i}-color'] = int(color)
+      d[f'n{i}-ttl'] = int(ttl)
+    d['score'] = self.score()
+    stats = StateStatistics(self)
+    d.update(stats.active_per_color())
+    d.update(stats.ttl_per_color())
+    return d
+
+
+  def active_counts(self):
+    active = self.node_colors[self.node_colors != -1]
+    return np.bincount(active, minlength=len(self.colors))
+
+
+  def count_active_nodes(self):
+    return int(np.count_nonzero(self.node_colors != -1))
+
+
+  def min_active_ttl(self):
+    ttls = self.node_ttls[self.node_colors != -1]
+    return int(ttls.min()) if len(ttls) else None
+
+
+  def all_nodes_expired(self):
+    return bool(np.all(self.node_ttls <= 0))
+
+
+class StateFactory:
+  """"""
+  @staticmethod
+  def options(): return ['object', 'array']
+
+
+  def get(self, name):
+    if name == 'object':
+      return State()
+    if name == 'array':
+      return ArrayState()
+
+
 class StateStatistics():
   """Computes statistics from a State object"""
   def __init__(self, state):
@@ -111,15 +364,14 @@ class StateStatistics():
 
 
   def active_per_color(self):
-    active_colors = [n.color for n in self.state.nodes]
-    d = {f'c{c}-n-active': active_colors.count(c) for c in self.colors}
+    n_active = self.state.n_active
+    d = {f'c{c}-n-active': int(n_active[c]) for c in self.colors}
     return d
 
 
   def ttl_per_color(self):
-    node_d = {c: [n for n in self.state.nodes if n.color == c] 
-      for c in self.colors}
-    ttl_d = {f'c{c}-total-ttl': sum([n.ttl for n in nodes]) for c, nodes in node_d.items()}
+    ttl_total = self.state.ttl_total
+    ttl_d = {f'c{c}-total-ttl': int(ttl_total[c]) for c in self.colors}
     return ttl_d
 
 
@@ -127,24 +379,180 @@ class StateStatistics():
     pass
 
 
+StateView = collections.namedtuple('StateView',
+  ['t', 'actvn_cnt', 'node_colors', 'node_ttls', 'score', 'n_active', 'ttl_total'])
+
+
 class History:
-  """Stores a list of State objects"""
+  """Stores the recorded states of a scenario as growable NumPy columns, with
+  one row per recorded tick. States are only rebuilt as objects on .read();
+  use .view() for cheap read-only access to a recorded row.
 
-  def __init__(self, initial_state):
-    self._records = [initial_state.copy()]
+  Parameters
+  ----------
+
+  initial_state (State) : the first state to record. A copy is kept as the
+  template for rebuilding states on .read()
+
+  capacity (int) : the number of rows to preallocate. Grows as required,
+  unless there is a sink.
+
+  sink (CsvSink) : if given, rows are streamed to the sink in chunks of
+  capacity rows, rather than kept for the whole scenario. Only the rows since
+  the last chunk can be viewed, and .flush() must be called to write the
+  remaining rows once the scenario ends.
+  """
+
+  def __init__(self, initial_state, capacity=64, sink=None):
+    self.sink = sink
+    self._offset = 0
+    self._flushed_score = 0.0
+    self._template = initial_state.copy()
+    self.colors = initial_state.colors
+    self.int_model = initial_state.int_model
+    self.n_nodes = len(initial_state.node_arrays()[0])
+    k = len(self.colors)
+    self._len = 0
+    self._t = np.empty(capacity, dtype=np.int64)
+    self._actvn_cnt = np.empty(capacity, dtype=np.int32)
+    self._node_colors = np.empty((capacity, self.n_nodes), dtype=np.int16)
+    self._node_ttls = np.empty((capacity, self.n_nodes), dtype=np.int16)
+    self._score = np.empty(capacity, dtype=np.float64)
+    self._n_active = np.empty((capacity, k), dtype=np.int32)
+    self._ttl_total = np.empty((capacity, k), dtype=np.int32)
+    self.record(initial_state)
+
+
+  def __len__(self):
+    return self._offset + self._len
+
+
+  def _grow(self, n):
+    """Ensure there is room for n more rows, doubling capacity as needed.
+    With a sink, the rows are flushed to the sink instead."""
+    capacity = len(self._t)
+    if self._len + n <= capacity: return
+    if self.sink is not None:
+      self.flush()
+      if n <= capacity: return
+    while capacity < self._len + n: capacity *= 2
+    for attr in ['_t', '_actvn_cnt', '_node_colors', '_node_ttls', '_score',
+      '_n_active', '_ttl_total']:
+      old = getattr(self, attr)
+      new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+      new[:self._len] = old[:self._len]
+      setattr(self, attr, new)
 
 
   def record(self, state):
-    self._records.append(state.copy())
+    self._grow(1)
+    i = self._len
+    node_colors, node_ttls = state.node_arrays()
+    self._t[i] = state.t
+    self._actvn_cnt[i] = state.actvn_cnt
+    self._node_colors[i] = node_colors
+    self._node_ttls[i] = node_ttls
+    self._score[i] = state.score()
+    self._n_active[i] = state.n_active
+    self._ttl_total[i] = state.ttl_total
+    self._len += 1
+
+
+  def record_span(self, state, n):
+    """Record the n ticks leading up to and including `state`, which must
+    have been reached by State.advance(n)"""
+    if self.sink is not None:
+      # record in pieces, so the buffer never grows past its capacity
+      capacity = len(self._t)
+      while n > capacity:
+        self._record_span(state, n, capacity)
+        n -= capacity
+    self._record_span(state, n, n)
+
+
+  def _record_span(self, state, n, m):
+    """Record the first m of the n ticks leading up to `state`"""
+    self._grow(m)
+    i = self._len
+    node_colors, node_ttls = state.node_arrays()
+    node_colors = np.asarray(node_colors)
+    offsets = np.arange(n - 1, n - 1 - m, -1)[:, None]
+    active = node_colors != -1
+    n_active = np.asarray(state.n_active)
+    self._t[i:i+m] = state.t - offsets[:, 0]
+    self._actvn_cnt[i:i+m] = state.actvn_cnt
+    self._node_colors[i:i+m] = node_colors
+    self._node_ttls[i:i+m] = np.asarray(node_ttls) + offsets * active
+    self._score[i:i+m] = state.score()
+    self._n_active[i:i+m] = n_active
+    self._ttl_total[i:i+m] = np.asarray(state.ttl_total) + offsets * n_active
+    self._len += m
+
+
+  def flush(self):
+    """Write the buffered rows to the sink, and drop them"""
+    n = self._len
+    if not n: return
+    self.sink.write(self._t[:n], self._actvn_cnt[:n], self._node_colors[:n],
+      self._node_ttls[:n], self._score[:n], self._n_active[:n],
+      self._ttl_total[:n])
+    self._flushed_score += float(self._score[:n].sum())
+    self._offset += n
+    self._len = 0
+
+
+  def view(self, i = -1):
+    """Read-only view of recorded row i, without rebuilding a State"""
+    i = range(len(self))[i] - self._offset
+    if i < 0: raise IndexError('History row has been flushed to the sink')
+    cols = []
+    for col in [self._node_colors[i], self._node_ttls[i], self._n_active[i],
+      self._ttl_total[i]]:
+      col = col.view()
+      col.flags.writeable = False
+      cols.append(col)
+    node_colors, node_ttls, n_active, ttl_total = cols
+    return StateView(int(self._t[i]), int(self._actvn_cnt[i]), node_colors,
+      node_ttls, float(self._score[i]), n_active, ttl_total)
 
 
   def read(self, i = None):
-    if i != None: return self._records[i].copy()
-    return [state.copy() for state in self._records]
+    if i != None: return self._state(i)
+    return [self._state(j) for j in range(len(self))]
+
+
+  def _state(self, i):
+    v = self.view(i)
+    return self._template.copy().load(v.t, v.actvn_cnt, v.node_colors, v.node_ttls)
 
 
   def score(self):
-    sum = 0
-    for state in self._records:
-      sum += state.score()
-    return sum
\ No newline at end of file
+    return self._flushed_score + float(self._score[:self._len].sum())
+
+
+  def to_df(self):
+    """Build a DataFrame with one row per recorded tick, directly from the
+    columns. Matches the layout of State.to_dict()"""
+    if self._offset:
+      raise ValueError('History has been flushed to a sink. Read the sink instead.')
+    n = self._len
+    return records_to_df(self.colors, self._t[:n], self._node_colors[:n],
+      self._node_ttls[:n], self._score[:n], self._n_active[:n], 
+      self._ttl_total[:n])
+
+
+def records_to_df(colors, t, node_colors, node_ttls, score, n_active, ttl_total):
+  """Build a DataFrame with one row per tick from per-tick columns, matching
+  the layout of State.to_dict()"""
+  d = {'t': t}
+  for i in range(node_colors.shape[1]):
+    d[f'n{i}-color'] = node_colors[:, i].astype(np.int64)
+    d[f'n{i}-ttl'] = node_ttls[:, i].astype(np.int64)
+  d['score'] = score
+  for j, c in enumerate(colors):
+    d[f'c{c}-n-active'] = n_active[:, j].astype(np.int64)
+  for j, c in enumerate(colors):
+    d[f'c{c}-total-ttl'] = ttl_total[:, j].astype(np.int64)
+  df = pd.DataFrame(d)
+  df.set_index('t', inplace=True)
+  return df
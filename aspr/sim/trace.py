@@ -0,0 +1,32 @@
+"""Structured per-tick tracing of runs, enabled with --trace"""
+
+import json
+
+TRACE_EXT = '.trace.jsonl'
+
+
+class TraceSink:
+  """Collects the events of a run as dicts, eg.
+
+    {'event': 'spawn', 't': 12, 'node': 3, 'color': 1}
+
+  rather than formatting them into debug log lines. Events are buffered in
+  memory and written as one JSON object per line by save().
+  """
+  def __init__(self):
+    self.events = []
+
+
+  def emit(self, event, **fields):
+    self.events.append(dict(event=event, **fields))
+
+
+  def save(self, path):
+    with open(path, 'w') as f:
+      for e in self.events: f.write(json.dumps(e) + '\n')
+    return path
+
+
+  @staticmethod
+  def read(path):
+    with open(path, 'r') as f: return [json.loads(line) for line in f]
@@ -35,4 +35,35 @@ def _setup_logger(cls, verbose=0):
     logger = logging.getLogger(cls.name)
     logger.setLevel(logging_level_dict[verbose])
 
-    return logger
\ No newline at end of file
+    return logger
+
+
+def parse_model_args(aarg, default_key):
+    """Parses additional model arguments given on the command line.
+
+    Arguments are given as 'key=value' pairs separated by commas, eg.
+    'ps=5,cache=1000'. A value without a key is taken to be `default_key`,
+    so a single bare value (eg. '5') keeps working.
+    Parameters
+    ----------
+    aarg : str or None
+        Argument string, as given to --decision-model-args
+    default_key : str
+        Key to use for a value given without one
+    Returns
+    -------
+    args : dict
+        Mapping of key to (string) value
+    """
+    args = {}
+    if aarg is None:
+        return args
+    for part in str(aarg).split(','):
+        if not part.strip():
+            continue
+        if '=' in part:
+            key, value = part.split('=', 1)
+            args[key.strip()] = value.strip()
+        else:
+            args[default_key] = part.strip()
+    return args
@@ -19,7 +19,9 @@ setup(
         'console_scripts': [
             'aspr_run=aspr.sim.experiment:cli',
             'aspr_spt=aspr.sim.spawntimes:cli',
-            'aspr_train=aspr.model.cli:cli'
+            'aspr_train=aspr.model.cli:cli',
+            'aspr_opt=aspr.sim.optimal:cli',
+            'aspr_bench=aspr.bench:cli'
         ],
     },
     install_requires=requirements,
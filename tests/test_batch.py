@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+
+from aspr.sim.batch import BatchScenario
+from aspr.sim.scenario import Scenario
+from aspr.sim.decision_model import DecisionModelBase, GreedyDecision, RoundRobinDecision
+from aspr.sim.interference_model import BinaryInterference
+
+
+class RunCycleDecision(DecisionModelBase):
+    """Picks colors from a fixed sequence per run, identified by seeding"""
+    def __init__(self, colors, seq):
+        super().__init__(colors)
+        self.seq = seq
+        self.i = 0
+
+    def decide(self, history):
+        decision = self.seq[self.i % len(self.seq)]
+        self.i += 1
+        return decision
+
+    def decide_batch(self, batch):
+        decisions = np.array([seq[self.i % len(seq)] for seq in self.seq])
+        self.i += 1
+        return decisions
+
+
+@pytest.mark.parametrize('spt', [
+    [1, 2],
+    [3, 8, 14, 15],
+    [2, 4, 6, 40, 90],
+])
+def test_batch_matches_scenario_01(spt):
+    seqs = [[0, 1, 2], [2, 2, 0], [1, 1, 1]]
+    batch = BatchScenario(3, len(spt), list(spt), range(3),
+        RunCycleDecision(range(3), seqs), BinaryInterference(), 'test_batch')
+    batch.run()
+
+    for r, seq in enumerate(seqs):
+        scenario = Scenario(len(spt), list(spt), range(3),
+            RunCycleDecision(range(3), seq), BinaryInterference(), 'test_batch')
+        scenario.run()
+        assert batch.to_df(r).equals(scenario.to_df())
+        assert batch.score_runs()[r] == scenario.score()
+
+
+def test_batch_fallback_decide_01():
+    spt = [1, 3, 4, 9, 10]
+    batch = BatchScenario(2, len(spt), list(spt), range(3),
+        GreedyDecision(range(3), ps=3), BinaryInterference(), 'test_batch')
+    batch.run()
+
+    scenario = Scenario(len(spt), list(spt), range(3),
+        GreedyDecision(range(3), ps=3), BinaryInterference(), 'test_batch')
+    scenario.run()
+    for r in range(2):
+        assert batch.to_df(r).equals(scenario.to_df())
+
+
+def test_batch_round_robin_01():
+    spt = [1, 3, 4, 9, 10]
+    batch = BatchScenario(4, len(spt), list(spt), range(3),
+        RoundRobinDecision(range(3)), BinaryInterference(), 'test_batch')
+    batch.run()
+    for r in range(4):
+        df = batch.to_df(r)
+        assert df.loc[1, 'n0-color'] == 0
+        assert df.loc[3, 'n1-color'] == 1
+        assert df.loc[4, 'n2-color'] == 2
@@ -0,0 +1,55 @@
+import json
+import pytest
+from click.testing import CliRunner
+
+from aspr import bench
+from aspr.bench import Benchmark, compare
+
+
+@pytest.fixture()
+def results():
+    return Benchmark(n_runs=2).run_grid([10], [3], [20, 5], ['random', 'greedy', 'linreg'])
+
+
+def test_bench_results_01(results):
+    # t=5 can't hold 10 unique spawn times, so is skipped
+    assert {r['time_window'] for r in results} == {20}
+    benches = [(r['bench'], r['decision_model']) for r in results]
+    for name in ['history_record', 'state_score', 'features_extract']:
+        assert (name, None) in benches
+    for dm in ['random', 'greedy', 'linreg']:
+        assert ('scenario_run', dm) in benches
+        assert ('decide', dm) in benches
+    for r in results:
+        assert r['calls'] > 0
+        assert r['per_call'] > 0
+        assert r['peak_kb'] >= 0
+    run = next(r for r in results if r['bench'] == 'scenario_run')
+    assert run['runs_per_sec'] > 0 and run['ticks_per_sec'] > run['runs_per_sec']
+
+
+def test_bench_compare_01(results):
+    assert compare(results, results, 0.2) == []
+    baseline = [dict(r, per_call=r['per_call'] / 2) for r in results]
+    regressions = compare(results, baseline, 0.2)
+    assert len(regressions) == len(results)
+    assert all(ratio == pytest.approx(2) for _, ratio in regressions)
+    assert compare(results, baseline, 1.5) == []
+
+
+def test_bench_cli_01(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    args = ['-n', '10', '-c', '2', '-t', '30', '-dm', 'random', '-r', '1']
+    result = runner.invoke(bench.cli, args + ['-o', 'base.json'])
+    assert result.exit_code == 0
+    with open(tmp_path / 'base.json') as f:
+        saved = json.load(f)
+    assert len(saved['results']) == 5
+
+    for r in saved['results']: r['per_call'] /= 100
+    with open(tmp_path / 'base.json', 'w') as f:
+        json.dump(saved, f)
+    result = runner.invoke(bench.cli, args + ['-o', 'new.json', '-b', 'base.json'])
+    assert result.exit_code == 1
+    assert 'REGRESSION' in result.output
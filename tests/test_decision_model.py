@@ -1,6 +1,18 @@
+import os
 import pytest
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
 
-from aspr.sim.decision_model import GreedyDecision
+from aspr.sim.decision_model import GreedyDecision, LinearRegressor, \
+    BeamDecision, DecisionModelFactory
+from aspr.sim.state import State, ArrayState, History
+from aspr.sim.scenario import Scenario
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.interference_model import BinaryInterference
+from aspr.model.linreg import LinearRegressorLearner
+from aspr.constants import OUTPUTS, MODELS, MDL_EXT
 
 @pytest.fixture()
 def greedy_dec_model():
@@ -30,3 +42,140 @@ def greedy_dec_model():
 def test_min_score_color_01(greedy_dec_model, scores, exp_min):
   assert greedy_dec_model.min_score_color(scores) == exp_min
 
+
+
+@pytest.fixture(params=['mdl', 'joblib'])
+def linreg_exp(tmp_path, monkeypatch, request):
+    """Trains random per-color regressors and saves them where
+    LinearRegressor loads them from, as one model file or one .joblib file
+    per color"""
+    monkeypatch.chdir(tmp_path)
+    colors = range(3)
+    features = [f'c{c}-n-active' for c in colors] + \
+        [f'c{c}-total-ttl' for c in colors] + ['decision']
+    path = os.path.join(OUTPUTS, 'linreg-test', 'nc3', MODELS, 'linreg')
+    os.makedirs(path)
+    rng = np.random.default_rng(0)
+    regrs = {}
+    for c in colors:
+        X = pd.DataFrame(rng.integers(0, 10, (50, len(features))), columns=features)
+        regrs[c] = LinearRegression().fit(X, rng.normal(size=50))
+        if request.param == 'joblib':
+            joblib.dump(regrs[c], os.path.join(path, f'{c}{MDL_EXT}'))
+    if request.param == 'mdl':
+        LinearRegressorLearner(colors).save_all(regrs, path)
+    return 'linreg-test', regrs, features
+
+
+def test_linreg_compiled_predict_01(linreg_exp):
+    exp_f, regrs, features = linreg_exp
+    model = LinearRegressor(colors=range(3), exp_f=exp_f)
+    state = State().init(size=6, int_model=BinaryInterference(), colors=range(3))
+    history = History(state)
+    for c in [0, 2, 2, 1, 0]:
+        state._tick(2).activate(c)
+        history.record(state)
+        feat = state.to_dict()
+        df = pd.DataFrame({f: [feat.get(f, 0)] for f in features})
+        exp_preds = []
+        for d in range(3):
+            df['decision'] = d
+            exp_preds.append(regrs[d].predict(df)[0])
+
+        x = model.get_feat_vector(history.view(-1))
+        assert np.allclose(model.predict(x), exp_preds)
+        assert model.decide(history) == int(np.argmin(exp_preds))
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+def test_greedy_cache_01(state_cls):
+    cached = GreedyDecision(colors=[0, 1, 2], ps=4)
+    uncached = GreedyDecision(colors=[0, 1, 2], ps=4, cache_size=0)
+    for seed in range(3):
+        spt = [int(t) for t in SpawnTimeUtil().random_unique(10, 25, seed)]
+        dfs = []
+        for model in [cached, uncached]:
+            scenario = Scenario(len(spt), list(spt), [0, 1, 2], model,
+                BinaryInterference(), 'test_greedy_cache_01',
+                engine='array' if state_cls is ArrayState else 'object')
+            scenario.run()
+            dfs.append(scenario.to_df())
+        assert dfs[0].equals(dfs[1])
+
+    stats = cached.stats()
+    assert stats['cache_hits'] > 0
+    assert stats['cache_hits'] + stats['cache_misses'] == 30
+    assert uncached.stats() == {'cache_hits': 0, 'cache_misses': 0}
+
+
+def test_greedy_cache_bounded_01():
+    model = GreedyDecision(colors=[0, 1], ps=2, cache_size=2)
+    spt = [1, 2, 3, 4, 5, 6]
+    Scenario(len(spt), spt, [0, 1], model, BinaryInterference(), 'test').run()
+    assert len(model._cache) <= 2
+
+
+def test_greedy_cache_pairwise_01():
+    class PairwiseBinaryInterference(BinaryInterference):
+        aggregate = False
+
+    model = GreedyDecision(colors=[0, 1], ps=2)
+    spt = [1, 2, 3, 4, 5, 6]
+    Scenario(len(spt), spt, [0, 1], model, PairwiseBinaryInterference(), 'test').run()
+    assert not model._cache
+    assert model.stats() == {'cache_hits': 0, 'cache_misses': 0}
+
+
+@pytest.mark.parametrize('ps', [1, 3, 11, 25])
+def test_greedy_analytic_01(ps):
+    state = ArrayState().init(size=12, int_model=BinaryInterference(), colors=range(3))
+    history = History(state)
+    sim = GreedyDecision(colors=[0, 1, 2], ps=ps, cache_size=0)
+    analytic = GreedyDecision(colors=[0, 1, 2], ps=ps, cache_size=0, mode='analytic')
+    for i, c in enumerate([0, 1, 0, 2, 0, 0, 1, 2, 1, 0, 2, 2]):
+        state._tick(i % 3).activate(c)
+        history.record(state)
+        assert analytic.lookahead(history) == sim.lookahead(history)
+    for _ in range(12):
+        history.record(state.tick())
+        assert analytic.lookahead(history) == sim.lookahead(history)
+
+
+def test_greedy_bad_mode_01():
+    with pytest.raises(ValueError):
+        GreedyDecision(colors=[0, 1], ps=1, mode='guess')
+
+
+def test_beam_depth_one_is_greedy_01():
+    spt = [1, 2, 3, 4, 5, 9, 10, 11, 13, 20]
+    dfs = []
+    for model in [BeamDecision([0, 1, 2], spt, depth=1),
+        GreedyDecision([0, 1, 2], ps=11, mode='analytic')]:
+        scenario = Scenario(len(spt), list(spt), [0, 1, 2], model,
+            BinaryInterference(), 'test_beam_depth_one_is_greedy_01')
+        scenario.run()
+        dfs.append(scenario.to_df())
+    assert dfs[0].equals(dfs[1])
+
+
+def test_beam_search_01():
+    model = BeamDecision([0, 1], [1, 2, 3, 4, 5], width=8, depth=4)
+    node_colors = np.array([0, 1, 1])
+    node_ttls = np.array([9, 2, 5])
+    gaps = [1, 1, 1, 11]
+    greedy_cost, _ = model.greedy(node_colors, node_ttls, gaps, BinaryInterference())
+    cost, path = model.search(node_colors, node_ttls, gaps, BinaryInterference())
+    assert cost <= greedy_cost
+    assert len(path) == 4
+
+
+def test_beam_factory_01():
+    model = DecisionModelFactory().get('beam', [0, 1], 'width=2,depth=5', 0,
+        spt=[3, 1, 2])
+    assert (model.width, model.depth, model.spt) == (2, 5, [1, 2, 3])
+
+    spt = [1, 2, 3]
+    Scenario(len(spt), spt, [0, 1], model, BinaryInterference(), 'test').run()
+    stats = model.stats()
+    assert stats['decisions'] == 3
+    assert stats['decide_time'] > 0
@@ -0,0 +1,165 @@
+import os
+import json
+import pytest
+import pandas as pd
+
+from aspr.sim.experiment import Experiment
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.output import RunStore
+from aspr.sim import profiler
+from aspr.sim.trace import TraceSink, TRACE_EXT
+from aspr.constants import OUTPUTS, PROFILE_FN
+
+
+@pytest.fixture()
+def spt_f(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stu = SpawnTimeUtil()
+    folder = os.path.join(OUTPUTS, 'exp-test')
+    os.makedirs(folder)
+    stu.save(stu.random_unique(8, 30, seed=1), folder)
+    return 'exp-test'
+
+
+def run_experiment(spt_f, dm_name, im_name='binary', im_args=None, **kwargs):
+    exp = Experiment(spt_f=spt_f, nc=3, nr=4, dm_name=dm_name, dm_args=None,
+        im_name=im_name, im_args=im_args, base_seed=0, verbose=0, **kwargs)
+    exp.run()
+    files = sorted(os.listdir(exp.exp_f))
+    dfs = [pd.read_csv(os.path.join(exp.exp_f, f)) for f in files]
+    for f in files: os.remove(os.path.join(exp.exp_f, f))
+    return files, dfs
+
+
+@pytest.mark.parametrize('dm_name', ['random', 'rrobin', 'greedy'])
+def test_jobs_deterministic_01(spt_f, dm_name):
+    files, dfs = run_experiment(spt_f, dm_name, jobs=1)
+    par_files, par_dfs = run_experiment(spt_f, dm_name, jobs=2)
+
+    assert files == par_files
+    assert len(files) == 4
+    for df, par_df in zip(dfs, par_dfs):
+        assert df.equals(par_df)
+
+
+def test_batch_size_01(spt_f):
+    files, dfs = run_experiment(spt_f, 'rrobin')
+    batch_files, batch_dfs = run_experiment(spt_f, 'rrobin', batch_size=3, jobs=2)
+
+    assert files == batch_files
+    for df, batch_df in zip(dfs, batch_dfs):
+        assert df.equals(batch_df)
+
+
+def test_output_format_npz_01(spt_f):
+    files, dfs = run_experiment(spt_f, 'random')
+    exp = Experiment(spt_f=spt_f, nc=3, nr=4, dm_name='random', dm_args=None,
+        im_name='binary', im_args=None, base_seed=0, verbose=0,
+        output_format='npz', jobs=2)
+    exp.run()
+
+    assert not [f for f in os.listdir(exp.exp_f) if f.endswith('.csv')]
+    runs = list(RunStore(exp.exp_f).read())
+    assert [run_id for run_id, _ in runs] == [0, 1, 2, 3]
+    # the runs are spread over both workers
+    assert len(RunStore(exp.exp_f).chunks()) == 2
+    for (_, df), csv_df in zip(runs, dfs):
+        assert df.astype(csv_df.dtypes).equals(csv_df)
+
+
+def test_greedy_args_01(spt_f):
+    exp = Experiment(spt_f=spt_f, nc=3, nr=1, dm_name='greedy',
+        dm_args='ps=3,cache=50', im_name='binary', im_args=None, base_seed=0,
+        verbose=0)
+    assert exp.dm.ps == 3
+    assert exp.dm.cache_size == 50
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(jobs=2),
+    dict(batch_size=2),
+    dict(event_driven=True, output_format='npz'),
+])
+def test_profile_01(spt_f, kwargs):
+    exp = Experiment(spt_f=spt_f, nc=3, nr=4, dm_name='greedy', dm_args=None,
+        im_name='binary', im_args=None, base_seed=0, verbose=0, profile=True,
+        **kwargs)
+    exp.run()
+    assert profiler.active is None
+
+    with open(os.path.join(exp.exp_f, PROFILE_FN)) as f:
+        summary = json.load(f)
+    counters = summary['counters']
+    assert counters['runs'] == 4
+    assert counters['decisions'] == 4 * 8
+    assert counters['ticks'] > counters['decisions']
+    assert counters['scores'] > 0
+    assert counters['bytes_written'] > 0
+    for phase in ['decide', 'record', 'write']:
+        assert summary['phases'][phase]['seconds'] > 0
+    assert summary['phases']['decide']['calls'] > 0
+
+
+def test_trace_01(spt_f):
+    exp = Experiment(spt_f=spt_f, nc=3, nr=2, dm_name='rrobin', dm_args=None,
+        im_name='binary', im_args=None, base_seed=0, verbose=0, trace=True)
+    exp.run()
+    traces = sorted(f for f in os.listdir(exp.exp_f) if f.endswith(TRACE_EXT))
+    assert traces == [f'{exp.name}-0{TRACE_EXT}', f'{exp.name}-1{TRACE_EXT}']
+    events = TraceSink.read(os.path.join(exp.exp_f, traces[0]))
+    assert len([e for e in events if e['event'] == 'spawn']) == 8
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(event_driven=True, jobs=2)])
+def test_stream_01(spt_f, kwargs):
+    files, dfs = run_experiment(spt_f, 'greedy', **kwargs)
+    stream_files, stream_dfs = run_experiment(spt_f, 'greedy', stream=True, **kwargs)
+
+    assert files == stream_files
+    for df, stream_df in zip(dfs, stream_dfs):
+        assert df.equals(stream_df)
+
+
+
+def test_matrix_interference_01(spt_f):
+    with open('identity.txt', 'w') as f:
+        f.write('1 0 0\n0 1 0\n0 0 1\n')
+    with open('leaky.txt', 'w') as f:
+        f.write('1 0.5 0\n0.5 1 0.5\n0 0.5 1\n')
+
+    # an identity matrix is the binary model
+    _, dfs = run_experiment(spt_f, 'greedy')
+    _, id_dfs = run_experiment(spt_f, 'greedy', im_name='matrix', im_args='identity.txt')
+    for df, id_df in zip(dfs, id_dfs):
+        assert df['score'].equals(id_df['score'].astype(df['score'].dtype))
+
+    with open('fractional.txt', 'w') as f:
+        f.write('1 0.1 0.3\n0.1 1 0.7\n0.3 0.7 1\n')
+    for weights in ['leaky.txt', 'fractional.txt']:
+        _, serial_dfs = run_experiment(spt_f, 'greedy', im_name='matrix', im_args=weights)
+        for batch_size in [2, 3]:
+            _, batch_dfs = run_experiment(spt_f, 'greedy', im_name='matrix',
+                im_args=weights, batch_size=batch_size)
+            for df, batch_df in zip(serial_dfs, batch_dfs):
+                assert df.equals(batch_df)
+
+    with pytest.raises(ValueError):
+        run_experiment(spt_f, 'greedy', im_name='matrix', im_args=None)
+    with open('small.txt', 'w') as f:
+        f.write('1 0\n0 1\n')
+    with pytest.raises(ValueError):
+        run_experiment(spt_f, 'greedy', im_name='matrix', im_args='small.txt')
+
+
+@pytest.mark.parametrize('kwargs, warns', [
+    (dict(engine='array'), True),
+    (dict(event_driven=True), True),
+    (dict(), False),
+])
+def test_batch_ignored_options_01(spt_f, caplog, kwargs, warns):
+    Experiment(spt_f=spt_f, nc=3, nr=4, dm_name='random', dm_args=None,
+        im_name='binary', im_args=None, base_seed=0, verbose=0, batch_size=2,
+        **kwargs)
+    assert ('are ignored' in caplog.text) == warns
+
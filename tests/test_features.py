@@ -0,0 +1,44 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from aspr.model.features import FeatureExtractor
+from aspr.sim.scenario import Scenario
+from aspr.sim.decision_model import RandomDecision
+from aspr.sim.interference_model import BinaryInterference
+from aspr.sim.spawntimes import SpawnTimeUtil
+
+
+def reference_extract(fe, csv_f):
+    """Decision by decision extraction, as FeatureExtractor.extract used to do"""
+    df = pd.read_csv(csv_f, dtype=int).astype({'score': float})
+    df['decision'] = -1
+    df['loss'] = 0.0
+    for spawn_num, t_index in enumerate(fe.spt):
+        df.loc[t_index-1, 'decision'] = df.loc[t_index, f'n{spawn_num}-color']
+        df.loc[t_index-1, 'loss'] = fe.loss_for_decision(df, spawn_num, t_index)
+    n_active_cols = [col for col in df.columns if 'n-active' in col]
+    total_ttl_cols = [col for col in df.columns if 'total-ttl' in col]
+    return df.loc[fe.spt, n_active_cols + total_ttl_cols + ['score', 'decision', 'loss']]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_extract_matches_reference_01(tmp_path, seed):
+    stu = SpawnTimeUtil()
+    spt = [int(t) for t in stu.random_unique(12, 40, seed)]
+    stu.save(spt, str(tmp_path))
+
+    np.random.seed(seed)
+    scenario = Scenario(len(spt), list(spt), range(3), RandomDecision(range(3)),
+        BinaryInterference(), 'test_extract')
+    scenario.run()
+    csv_f = os.path.join(str(tmp_path), 'run.csv')
+    scenario.to_df().to_csv(csv_f, index=False)
+
+    fe = FeatureExtractor(os.path.join(str(tmp_path), 'spt.txt'))
+    feat_df = fe.extract(csv_f)
+    exp_df = reference_extract(fe, csv_f)
+
+    assert feat_df.equals(exp_df)
+    assert list(feat_df['decision']).count(-1) < len(spt)
@@ -0,0 +1,123 @@
+import pytest
+import numpy as np
+from aspr.sim.state import State, ArrayState
+from aspr.sim.interference_model import BinaryInterference, MatrixInterference, \
+  InterferenceModelFactory
+
+
+class PairwiseBinaryInterference(BinaryInterference):
+  """Forces State to score pair by pair"""
+  aggregate = False
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+@pytest.mark.parametrize('activations', [
+  [],
+  [0],
+  [0, 0],
+  [0, 1, 0, 2, 0, 1],
+  [3, 3, 3, 3, 3],
+])
+def test_score_counts_matches_pairwise_01(state_cls, activations):
+  state = state_cls().init(size=6, int_model=BinaryInterference(), colors=range(4))
+  pairwise = state_cls().init(size=6, int_model=PairwiseBinaryInterference(), colors=range(4))
+  for c in activations:
+    state.tick().activate(c)
+    pairwise.tick().activate(c)
+  assert state.score() == pairwise.score()
+
+
+@pytest.mark.parametrize('counts, exp_score', [
+  ([0, 0, 0], 0),
+  ([1, 1, 1], 0),
+  ([2, 0, 1], 1),
+  ([3, 4, 0], 9),
+])
+def test_score_counts_01(counts, exp_score):
+  assert BinaryInterference().score_counts(counts) == exp_score
+
+
+class PairwiseMatrixInterference(MatrixInterference):
+  """Forces State to score pair by pair"""
+  aggregate = False
+
+
+# adjacent channels leak into each other; the last is asymmetric
+LEAKY = [
+  [1.0, 0.5, 0.0, 0.0],
+  [0.5, 1.0, 0.5, 0.0],
+  [0.0, 0.5, 1.0, 0.5],
+  [0.0, 0.0, 0.5, 1.0],
+]
+ASYMMETRIC = [
+  [2.0, 1.0, 0.0, 0.0],
+  [0.0, 1.0, 3.0, 0.0],
+  [0.5, 0.0, 1.0, 0.0],
+  [0.0, 0.0, 0.0, 0.0],
+]
+# not exact in floating point
+FRACTIONAL = [
+  [1.0, 0.1, 0.3, 0.0],
+  [0.1, 1.0, 0.7, 0.3],
+  [0.3, 0.7, 1.0, 0.1],
+  [0.0, 0.3, 0.1, 1.0],
+]
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+@pytest.mark.parametrize('weights', [LEAKY, ASYMMETRIC, FRACTIONAL])
+@pytest.mark.parametrize('activations', [
+  [],
+  [0],
+  [0, 1, 0, 2, 0, 1],
+  [3, 2, 1, 0, 2, 3],
+])
+def test_matrix_matches_pairwise_01(state_cls, weights, activations):
+  state = state_cls().init(size=6, int_model=MatrixInterference(weights), colors=range(4))
+  pairwise = state_cls().init(size=6, int_model=PairwiseMatrixInterference(weights),
+    colors=range(4))
+  for c in activations:
+    state.tick().activate(c)
+    pairwise.tick().activate(c)
+    assert state.score() == pytest.approx(pairwise.score())
+  # nodes expiring
+  for _ in range(12):
+    state.tick()
+    pairwise.tick()
+    assert state.score() == pytest.approx(pairwise.score())
+  # no rounding error is left once every node has expired
+  assert state.score() == 0
+
+
+def test_matrix_score_counts_01():
+  binary, identity = BinaryInterference(), MatrixInterference(np.eye(3))
+  counts = np.array([[0, 0, 0], [2, 0, 1], [3, 4, 0]])
+  assert np.array_equal(identity.score_counts(counts), binary.score_counts(counts))
+  leaky = MatrixInterference(LEAKY)
+  assert leaky.score_counts([1, 1, 0, 0]) == 0.5
+  assert leaky.add_delta([1, 2, 1, 0], 1) == 2 * 1.0 + 0.5 + 0.5
+  with pytest.raises(ValueError):
+    MatrixInterference([[1, 0]])
+  with pytest.raises(ValueError):
+    MatrixInterference([[1, -0.5], [-0.5, 1]])
+
+
+def test_matrix_factory_01(tmp_path):
+  path = tmp_path / 'weights.txt'
+  path.write_text('1, 0.5\n0.5, 1\n')
+  for args in [str(path), f'weights={path}']:
+    im = InterferenceModelFactory().get('matrix', args)
+    assert np.array_equal(im.weights, [[1, 0.5], [0.5, 1]])
+  with pytest.raises(ValueError):
+    InterferenceModelFactory().get('matrix', None)
+
+
+@pytest.mark.parametrize('int_model', [BinaryInterference(),
+  MatrixInterference(ASYMMETRIC), MatrixInterference(FRACTIONAL)])
+def test_add_deltas_01(int_model):
+  counts = np.array([[0, 0, 0, 0], [2, 0, 1, 3], [1, 4, 0, 2]])
+  exp = [[int_model.add_delta(row, c) for c in range(4)] for row in counts]
+  assert np.allclose(int_model.add_deltas(counts), exp)
+  # the generic version, from add_delta()
+  assert np.allclose(super(type(int_model), int_model).add_deltas(counts), exp)
+
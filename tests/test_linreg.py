@@ -0,0 +1,119 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+from aspr.model.linreg import LinearRegressorLearner, read_model, \
+    MODEL_MAGIC, MODEL_VERSION
+from aspr.constants import LINREG_MODEL_FN
+
+
+def write_features(folder, name, n_rows, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'c0-n-active': rng.integers(0, 5, n_rows),
+        'c1-n-active': rng.integers(0, 5, n_rows),
+        'c0-total-ttl': rng.integers(0, 50, n_rows),
+        'c1-total-ttl': rng.integers(0, 50, n_rows),
+        'score': rng.integers(0, 10, n_rows),
+        'decision': rng.integers(0, 2, n_rows),
+    })
+    df['loss'] = 0.5 * df['c0-n-active'] - 0.1 * df['c1-total-ttl'] + \
+        rng.normal(size=n_rows)
+    df.to_csv(os.path.join(folder, name), index=False)
+    return df
+
+
+def batch_fit(df, c):
+    c_df = df.loc[df['decision'] == c]
+    return LinearRegression().fit(c_df.drop(columns=['score', 'loss']), c_df['loss'])
+
+
+@pytest.fixture()
+def feat_f(tmp_path):
+    folder = tmp_path / 'exp' / 'data' / 'runs-feat'
+    os.makedirs(folder)
+    return str(folder)
+
+
+def assert_same_fit(regrs, df):
+    for c in [0, 1]:
+        exp = batch_fit(df, c)
+        X = df.drop(columns=['score', 'loss'])
+        np.testing.assert_allclose(regrs[c].predict(X), exp.predict(X), atol=1e-8)
+        np.testing.assert_allclose(regrs[c].intercept_, exp.intercept_, atol=1e-8)
+
+
+def test_train_stream_01(feat_f):
+    dfs = [write_features(feat_f, f'run-{i}.csv', 200, i) for i in range(3)]
+    learner = LinearRegressorLearner(colors=range(2))
+    regrs = learner.train(feat_f, stream=True, chunk_size=64)
+    assert_same_fit(regrs, pd.concat(dfs, ignore_index=True))
+    assert os.path.exists(os.path.join(learner.model_out_f(feat_f), LINREG_MODEL_FN))
+
+
+def test_train_stream_incremental_01(feat_f, monkeypatch):
+    dfs = [write_features(feat_f, f'run-{i}.csv', 100, i) for i in range(2)]
+    learner = LinearRegressorLearner(colors=range(2))
+    learner.train(feat_f, stream=True)
+
+    # only the new file should be read
+    dfs.append(write_features(feat_f, 'run-2.csv', 100, 2))
+    read = []
+    iter_f = learner.iter_f
+    monkeypatch.setattr(learner, 'iter_f',
+        lambda folder, paths, chunk_size: read.extend(paths) or iter_f(folder, paths, chunk_size))
+    regrs = learner.train(feat_f, stream=True)
+    assert [os.path.basename(p) for p in read] == ['run-2.csv']
+    assert_same_fit(regrs, pd.concat(dfs, ignore_index=True))
+
+    # a changed file means starting again
+    dfs[0] = write_features(feat_f, 'run-0.csv', 50, 9)
+    read.clear()
+    regrs = learner.train(feat_f, stream=True)
+    assert len(read) == 3
+    assert_same_fit(regrs, pd.concat(dfs, ignore_index=True))
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_train_parallel_01(feat_f, jobs):
+    from sklearn.model_selection import train_test_split
+    df = pd.concat([write_features(feat_f, f'run-{i}.csv', 100, i) for i in range(2)],
+        ignore_index=True).drop(columns='score')
+    regrs = LinearRegressorLearner(colors=range(2)).train(feat_f, jobs=jobs)
+    for c in [0, 1]:
+        c_df = df.loc[df['decision'] == c]
+        X_train, _, y_train, _ = train_test_split(c_df.drop(columns='loss'),
+            c_df['loss'], test_size=0.2, random_state=42)
+        exp = LinearRegression().fit(X_train, y_train)
+        np.testing.assert_allclose(regrs[c].coef_, exp.coef_, atol=1e-6)
+        np.testing.assert_allclose(regrs[c].intercept_, exp.intercept_, atol=1e-6)
+
+
+def test_model_file_01(feat_f):
+    write_features(feat_f, 'run-0.csv', 100, 0)
+    learner = LinearRegressorLearner(colors=range(2))
+    regrs = learner.train(feat_f)
+    path = os.path.join(learner.model_out_f(feat_f), LINREG_MODEL_FN)
+    meta, weights = read_model(path)
+    assert isinstance(weights, np.memmap)
+    assert meta['version'] == MODEL_VERSION
+    assert meta['features'] == learner.state_features + ['decision', 'intercept']
+    assert np.array_equal(weights, learner.compile(regrs))
+
+    # retraining replaces the file, leaving the mapped weights intact
+    old = np.array(weights)
+    write_features(feat_f, 'run-1.csv', 100, 1)
+    new_regrs = learner.train(feat_f)
+    assert np.array_equal(weights, old)
+    assert np.array_equal(read_model(path)[1], learner.compile(new_regrs))
+    assert not np.array_equal(old, learner.compile(new_regrs))
+    assert os.listdir(os.path.dirname(path)) == [LINREG_MODEL_FN]
+    del weights
+
+    with open(path, 'r+b') as f:
+        f.seek(len(MODEL_MAGIC))
+        f.write(np.array([MODEL_VERSION + 1], dtype='<u2').tobytes())
+    with pytest.raises(ValueError):
+        read_model(path)
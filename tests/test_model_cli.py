@@ -0,0 +1,82 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from aspr.model.cli import make_features
+from aspr.sim.experiment import Experiment
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.output import RunStore
+from aspr.model.features import FeatureExtractor
+from aspr.constants import OUTPUTS, SPT_FN
+
+
+@pytest.fixture()
+def exp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stu = SpawnTimeUtil()
+    folder = os.path.join(OUTPUTS, 'feat-test')
+    os.makedirs(folder)
+    stu.save(stu.random_unique(8, 30, seed=1), folder)
+    def run(nr, base_seed=0, im_name='binary', im_args=None, **kwargs):
+        exp = Experiment(spt_f='feat-test', nc=3, nr=nr, dm_name='random',
+            dm_args=None, im_name=im_name, im_args=im_args, base_seed=base_seed,
+            verbose=0, **kwargs)
+        exp.run()
+        return exp
+    return run
+
+
+def test_make_features_incremental_01(exp):
+    data_f = exp(2).exp_f
+    feat_f = make_features(data_f, range(3), 0)
+    first = sorted(f for f in os.listdir(feat_f) if '.csv' in f)
+    assert len(first) == 2
+    mtimes = {f: os.stat(os.path.join(feat_f, f)).st_mtime_ns for f in first}
+
+    # one new run: only its features should be extracted
+    os.rename(os.path.join(data_f, 'random-binary-1.csv'),
+        os.path.join(data_f, 'random-binary-9.csv'))
+    make_features(data_f, range(3), 0, jobs=2)
+    second = sorted(f for f in os.listdir(feat_f) if '.csv' in f)
+    assert second == ['random-binary-0.csv', 'random-binary-9.csv']
+    assert os.stat(os.path.join(feat_f, 'random-binary-0.csv')).st_mtime_ns == \
+        mtimes['random-binary-0.csv']
+
+
+def test_make_features_store_01(exp):
+    data_f = exp(4, output_format='npz').exp_f
+    feat_f = make_features(data_f, range(3), 0, jobs=2)
+    feat_df = RunStore(feat_f, prefix='feat').read_df()
+    assert sorted(feat_df['run'].unique()) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npz'])
+def test_make_features_matrix_01(exp, output_format):
+    with open('weights.txt', 'w') as f:
+        f.write('1 0.1 0.3\n0.1 1 0.7\n0.3 0.7 1\n')
+    data_f = exp(2, im_name='matrix', im_args='weights.txt',
+        output_format=output_format).exp_f
+    feat_f = make_features(data_f, range(3), 0)
+
+    fe = FeatureExtractor(os.path.join(OUTPUTS, 'feat-test', SPT_FN))
+    if output_format == 'csv':
+        runs = [pd.read_csv(os.path.join(data_f, f))
+            for f in sorted(os.listdir(data_f)) if f.endswith('.csv')]
+        feats = [pd.read_csv(os.path.join(feat_f, f))
+            for f in sorted(os.listdir(feat_f)) if f.endswith('.csv')]
+    else:
+        runs = [df for _, df in RunStore(data_f).read()]
+        feats = [df for _, df in RunStore(feat_f, prefix='feat').read()]
+    assert len(runs) == len(feats) == 2
+
+    scores = np.concatenate([run['score'].to_numpy() for run in runs])
+    assert np.any(scores != np.round(scores))
+    for run, feat in zip(runs, feats):
+        score = run['score'].to_numpy(dtype=float)
+        spt = np.asarray(fe.spt)
+        assert np.allclose(feat['score'], score[spt])
+        loss = np.zeros(len(score))
+        loss[spt - 1] = fe.losses_for_decisions(score, spt)
+        assert np.allclose(feat['loss'], loss[spt])
+
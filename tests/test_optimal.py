@@ -0,0 +1,79 @@
+import json
+import itertools
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from aspr.sim import optimal, spawntimes
+from aspr.sim.optimal import OptimalSolver
+from aspr.sim.decision_model import DecisionModelBase
+from aspr.sim.scenario import Scenario
+from aspr.sim.spawntimes import SpawnTimeUtil
+from aspr.sim.interference_model import BinaryInterference
+from aspr.constants import OUTPUTS, OPTIMAL_FN
+
+
+class ReplayDecision(DecisionModelBase):
+    """Colors spawns from a fixed list"""
+    def __init__(self, colors, decisions):
+        super().__init__(colors)
+        self.decisions = list(decisions)
+
+    def decide(self, history):
+        return self.decisions.pop(0)
+
+
+@pytest.mark.parametrize('seed, n, t_win, k', [
+    (0, 7, 30, 2),
+    (1, 8, 20, 3),
+    (2, 8, 40, 2),
+    (3, 6, 12, 3),
+])
+def test_optimal_brute_force_01(seed, n, t_win, k):
+    spt = SpawnTimeUtil().random_unique(n, t_win, seed)
+    solver = OptimalSolver(spt, list(range(k)))
+    result = solver.solve()
+    brute = min(solver.score(colors)
+        for colors in itertools.product(range(k), repeat=n))
+    assert result['score'] == brute
+    assert result['optimal']
+    assert solver.score(result['colors']) == brute
+
+    # the search on its own, without the greedy coloring as a bound
+    bounds = solver.remaining_bounds()
+    assert bounds[0] <= brute
+    score, labels, _, _, _ = solver.search(None, np.inf, [], bounds)
+    assert score == brute
+    assert solver.score(labels) == brute
+
+
+def test_optimal_scenario_score_01():
+    spt = [1, 2, 4, 5, 6, 9, 12, 13, 15, 18, 19, 22]
+    result = OptimalSolver(spt, [0, 1, 2]).solve()
+    scenario = Scenario(len(spt), list(spt), [0, 1, 2],
+        ReplayDecision([0, 1, 2], result['colors']), BinaryInterference(),
+        'test_optimal_scenario_score_01')
+    scenario.run()
+    assert scenario.score() == result['score']
+
+
+def test_optimal_bounded_01():
+    spt = SpawnTimeUtil().random_unique(40, 60, 0)
+    solver = OptimalSolver(spt, [0, 1, 2])
+    bounds = solver.remaining_bounds()
+    exact, _, _, _, _ = solver.search(None, np.inf, [], bounds)
+    score, _, dropped, _, max_layer = solver.search(2, np.inf, [], bounds)
+    assert max_layer == 2
+    assert min(score, dropped) <= exact <= score
+
+
+def test_optimal_cli_01(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    runner.invoke(spawntimes.cli, ['-i', 'opt-test', '-n', '40', '-t', '100'])
+    result = runner.invoke(optimal.cli, ['-s', 'opt-test', '-c', '3'])
+    assert result.exit_code == 0
+    with open(tmp_path / OUTPUTS / 'opt-test' / 'nc3' / OPTIMAL_FN) as f:
+        saved = json.load(f)
+    assert saved['optimal']
+    assert len(saved['colors']) == 40
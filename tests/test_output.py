@@ -0,0 +1,107 @@
+import os
+import io
+import pytest
+import numpy as np
+import pandas as pd
+
+from aspr.sim.output import RunStore, CsvSink
+from aspr.sim.scenario import Scenario
+from aspr.sim.decision_model import RoundRobinDecision
+from aspr.sim.interference_model import BinaryInterference
+from aspr.model.linreg import LinearRegressorLearner
+
+
+def run_df(run_id, n_rows):
+    return pd.DataFrame({
+        'n0-color': np.full(n_rows, run_id % 3),
+        'n0-ttl': np.arange(n_rows),
+        'score': np.linspace(0, 1, n_rows),
+    })
+
+
+def test_run_store_roundtrip_01(tmp_path):
+    store = RunStore(str(tmp_path), chunk_size=2)
+    for run_id in range(5):
+        store.append(run_id, run_df(run_id, 4 + run_id))
+    store.flush()
+
+    assert len(store.chunks()) == 3
+    runs = list(RunStore(str(tmp_path)).read())
+    assert [run_id for run_id, _ in runs] == list(range(5))
+    for run_id, df in runs:
+        assert df.astype({'n0-color': int, 'n0-ttl': int}).equals(run_df(run_id, 4 + run_id))
+
+
+def test_run_store_compact_dtypes_01(tmp_path):
+    store = RunStore(str(tmp_path))
+    store.append(0, run_df(0, 300))
+    store.flush()
+
+    df = store.read_df()
+    assert df['run'].dtype == np.int8
+    assert df['n0-color'].dtype == np.int8
+    assert df['n0-ttl'].dtype == np.int16
+    assert df['score'].dtype == np.float64
+
+
+def test_read_f_store_01(tmp_path):
+    store = RunStore(str(tmp_path), prefix='feat')
+    for run_id in range(3):
+        store.append(run_id, pd.DataFrame({
+            'c0-n-active': [run_id, 1], 'decision': [0, 1], 'loss': [0.5, 1.5]}))
+    store.flush()
+
+    df = LinearRegressorLearner(colors=range(1)).read_f(str(tmp_path))
+    assert list(df.columns) == ['c0-n-active', 'decision', 'loss']
+    assert len(df.index) == 6
+
+
+def test_read_f_cache_01(tmp_path):
+    for i in range(3):
+        pd.DataFrame({'c0-n-active': [i, 1], 'c0-total-ttl': [10, 20],
+            'decision': [0, 1], 'loss': [0.5, 1.5]}).to_csv(
+            tmp_path / f'run-{i}.csv', index=False)
+    learner = LinearRegressorLearner(colors=range(1))
+    df = learner.read_f(str(tmp_path), jobs=2, cache=True)
+    assert len(df.index) == 6
+    assert df['c0-n-active'].dtype == np.int16
+    assert df['c0-total-ttl'].dtype == np.int32
+    assert df['loss'].dtype == np.float32
+    assert (tmp_path / 'features-cache' / 'meta.json').exists()
+
+    cached = learner.read_f(str(tmp_path), cache=True)
+    pd.testing.assert_frame_equal(cached.copy(), df)
+    # the columns are the memory maps, not copies of them
+    for col in cached.columns:
+        arr = cached[col].to_numpy()
+        while not isinstance(arr, np.memmap) and arr.base is not None:
+            arr = arr.base
+        assert isinstance(arr, np.memmap)
+
+    # the cache is rebuilt when a feature file changes
+    pd.DataFrame({'c0-n-active': [7], 'c0-total-ttl': [30],
+        'decision': [0], 'loss': [2.5]}).to_csv(tmp_path / 'run-3.csv', index=False)
+    assert len(learner.read_f(str(tmp_path), cache=True).index) == 7
+
+
+@pytest.mark.parametrize('event_driven', [False, True])
+def test_csv_sink_01(tmp_path, event_driven):
+    # the quiet ticks before 80 are longer than a chunk
+    spt = [1, 2, 4, 30, 31, 33, 80, 81]
+    dfs = []
+    for sink in [None, CsvSink(str(tmp_path / 'run.csv'), [0, 1], chunk_size=4)]:
+        scenario = Scenario(len(spt), list(spt), [0, 1], RoundRobinDecision([0, 1]),
+            BinaryInterference(), 'test_csv_sink_01', event_driven=event_driven,
+            sink=sink)
+        scenario.run()
+        dfs.append(scenario.to_df() if sink is None else None)
+        scores = scenario.score()
+    full = dfs[0]
+    streamed = pd.read_csv(tmp_path / 'run.csv')
+    assert streamed.equals(pd.read_csv(io.StringIO(full.to_csv(index=False))))
+    assert len(scenario.history) == len(full.index)
+    assert scores == full['score'].sum()
+    # only the last chunk is kept
+    assert len(scenario.history._t) == 4
+    with pytest.raises(ValueError):
+        scenario.to_df()
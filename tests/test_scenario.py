@@ -3,6 +3,7 @@ import pytest
 from aspr.sim.scenario import Scenario
 from aspr.sim.decision_model import RoundRobinDecision
 from aspr.sim.interference_model import BinaryInterference
+from aspr.sim.trace import TraceSink
 
 
 @pytest.fixture()
@@ -69,3 +70,67 @@ def test_color_reset_01(rr_dec_model, binary_int_model):
     assert df.loc[12, 'n0-color'] == -1
     assert df.loc[12, 'n1-color'] == 1
     assert df.loc[13, 'n1-color'] == -1
+
+
+def test_array_engine_01(binary_int_model):
+    dfs = []
+    for engine in ['object', 'array']:
+        scenario = Scenario(
+            n_nodes=4,
+            spt=[1, 2, 4, 20],
+            colors=range(2),
+            dec_model=RoundRobinDecision(colors=[0, 1]),
+            int_model=binary_int_model,
+            name='test_array_engine_01',
+            engine=engine)
+        scenario.run()
+        dfs.append(scenario.to_df())
+
+    assert dfs[0].equals(dfs[1])
+
+
+@pytest.mark.parametrize('engine', ['object', 'array'])
+@pytest.mark.parametrize('n_nodes, spt', [
+    (2, [1, 2]),
+    (1, [5]),
+    (3, [1, 30, 31]),
+    (4, [3, 8, 14, 15]),
+    (5, [2, 4, 6, 40, 90]),
+])
+def test_event_driven_01(binary_int_model, engine, n_nodes, spt):
+    dfs = []
+    for event_driven in [False, True]:
+        scenario = Scenario(
+            n_nodes=n_nodes,
+            spt=list(spt),
+            colors=range(2),
+            dec_model=RoundRobinDecision(colors=[0, 1]),
+            int_model=binary_int_model,
+            name='test_event_driven_01',
+            engine=engine,
+            event_driven=event_driven)
+        scenario.run()
+        dfs.append(scenario.to_df())
+
+    assert dfs[0].equals(dfs[1])
+
+
+def test_trace_01():
+    spt = [1, 2, 4, 9]
+    traces = []
+    for event_driven in [False, True]:
+        trace = TraceSink()
+        scenario = Scenario(len(spt), list(spt), [0, 1], RoundRobinDecision([0, 1]),
+            BinaryInterference(), 'test_trace_01', event_driven=event_driven,
+            trace=trace)
+        scenario.run()
+        traces.append(trace.events)
+
+    spawns = [e for e in traces[0] if e['event'] == 'spawn']
+    assert [(e['t'], e['node'], e['color']) for e in spawns] == \
+        [(1, 0, 0), (2, 1, 1), (4, 2, 0), (9, 3, 1)]
+    assert spawns == [e for e in traces[1] if e['event'] == 'spawn']
+    ticks = [e for e in traces[0] if e['event'] == 'tick']
+    # the initial state and the tick of end_run() aren't traced
+    assert len(ticks) == len(scenario.history) - 2
+    assert any(e['event'] == 'skip' for e in traces[1])
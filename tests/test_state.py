@@ -1,5 +1,6 @@
 import pytest
-from aspr.sim.state import State, StateStatistics
+import pandas as pd
+from aspr.sim.state import State, ArrayState, StateStatistics, History
 from aspr.sim.interference_model import BinaryInterference
 
 @pytest.fixture()
@@ -132,3 +133,108 @@ def test_ttl_per_color_02(state):
     'c2-total-ttl': 0, 
     'c3-total-ttl': 4, 
     'c4-total-ttl': 0}
+
+
+@pytest.mark.parametrize('ops', [
+  [('tick', 1), ('activate', 0), ('tick', 1), ('activate', 1), ('tick', 3)],
+  [('tick', 1), ('activate', 0), ('tick', 5), ('activate', 0), ('tick', 12)],
+  [('activate', 2), ('activate', 2), ('activate', 2), ('tick', 11), ('activate', 1)],
+])
+def test_array_state_matches_state_01(ops):
+  state = State().init(size=5, int_model=BinaryInterference(), colors=range(5))
+  array_state = ArrayState().init(size=5, int_model=BinaryInterference(), colors=range(5))
+  for op, arg in ops:
+    for s in (state, array_state):
+      if op == 'tick': s._tick(arg)
+      else: s.activate(arg)
+    assert array_state.to_dict() == state.to_dict()
+    assert array_state.count_active_nodes() == state.count_active_nodes()
+    assert array_state.all_nodes_expired() == state.all_nodes_expired()
+
+
+def test_array_state_copy_01():
+  state = ArrayState().init(size=5, int_model=BinaryInterference(), colors=range(5))
+  state.tick().activate(0)
+  copy_state = state.copy()
+  copy_state.tick().activate(1)
+
+  assert isinstance(copy_state, ArrayState)
+  assert copy_state.count_active_nodes() != state.count_active_nodes()
+  assert copy_state.actvn_cnt != state.actvn_cnt
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+def test_copy_shares_logger_01(state_cls):
+  state = state_cls().init(size=3, int_model=BinaryInterference(), colors=range(2))
+  copy_state = state.copy()
+  assert 'logger' not in vars(copy_state)
+  assert copy_state.logger is state.logger
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+def test_copy_shares_immutable_01(state_cls):
+  state = state_cls().init(size=3, int_model=BinaryInterference(), colors=range(2))
+  state.tick().activate(1)
+  copy_state = state.copy()
+  assert copy_state.int_model is state.int_model
+  assert copy_state.colors is state.colors
+
+  copy_state.tick().activate(0)
+  assert state.node_arrays()[0][1] == -1
+  assert state.node_arrays()[1][0] == 10
+  assert list(state.n_active) == [0, 1]
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+def test_running_stats_match_recount_01(state_cls):
+  state = state_cls().init(size=8, int_model=BinaryInterference(), colors=range(3))
+  for i, c in enumerate([0, 1, 0, 0, 2, 1, 0, 2]):
+    state._tick(i % 4).activate(c)
+    fresh = state.copy()._recount()
+    assert list(state.n_active) == list(fresh.n_active)
+    assert list(state.ttl_total) == list(fresh.ttl_total)
+    assert state.score() == fresh.score()
+  state._tick(12)
+  assert list(state.n_active) == [0, 0, 0]
+  assert list(state.ttl_total) == [0, 0, 0]
+  assert state.score() == 0
+
+
+@pytest.mark.parametrize('state_cls', [State, ArrayState])
+def test_history_to_df_01(state_cls):
+  state = state_cls().init(size=4, int_model=BinaryInterference(), colors=range(3))
+  history = History(state, capacity=2)
+  for c in [0, 0, 1, 0]:
+    state._tick(3).activate(c)
+    history.record(state)
+  for _ in range(12):
+    history.record(state.tick())
+
+  exp_df = pd.DataFrame([s.to_dict() for s in history.read()]).set_index('t')
+  assert history.to_df().equals(exp_df)
+  assert len(history) == 17
+  assert history.score() == sum(s.score() for s in history.read())
+
+
+def test_history_read_01(state):
+  history = History(state)
+  state.tick().activate(2)
+  history.record(state)
+  state.tick()
+
+  read_state = history.read(-1)
+  assert read_state.t == 1
+  assert read_state.to_dict() == history.read()[1].to_dict()
+  assert read_state.n_active == [0, 0, 1, 0, 0]
+
+
+def test_history_view_01(state):
+  history = History(state)
+  state.tick().activate(2)
+  history.record(state)
+
+  view = history.view()
+  assert view.t == 1
+  assert list(view.n_active) == [0, 0, 1, 0, 0]
+  with pytest.raises(ValueError):
+    view.node_colors[0] = 1